@@ -0,0 +1,350 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Headless benchmark for octopicontrol.py. Runs the status loop from main()
+# and the Matrix screensaver under SDL's dummy video driver, against the
+# stand-in server from fake_octoprint.py, and reports frames per second,
+# CPU time per frame, request latency, touch-to-present latency and how long
+# it takes from starting the script to its first frame and first status.
+#
+#   python benchmark.py --seconds 20 --latency 0.05 --failure-rate 0.1
+#
+# Save a run with --json and compare it with --compare after an upgrade.
+
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# must be set before pygame is imported
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+
+scripts = os.path.dirname(os.path.realpath(__file__))
+src = os.path.dirname(scripts)
+sys.path.insert(0, src)
+
+def start_server(port, latency, failure_rate):
+    # a process of its own, so its CPU time and its hold on the GIL don't
+    # count against the display
+    server = subprocess.Popen([sys.executable, os.path.join(scripts, 'fake_octoprint.py'), '--port', str(port),
+                               '--latency', str(latency), '--failure-rate', str(failure_rate)],
+                              stdout = open(os.devnull, 'w'))
+
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return server
+        except socket.error:
+            time.sleep(0.05)
+
+    server.terminate()
+    raise RuntimeError("fake OctoPrint didn't start on port %d" % port)
+
+def write_config(port, push, **extra):
+    settings = {
+        'url': "http://127.0.0.1:%d" % port,
+        'apikey': 'benchmark',
+        'push': push,
+        'profile': True,
+        'profile_window': 1000000,
+        'profile_interval': 1e9,
+        'frame_cache': None,
+        'log_level': 'WARNING'
+    }
+    settings.update(extra)
+
+    config_file = tempfile.NamedTemporaryFile(suffix = '.json', delete = False)
+    json.dump(settings, config_file)
+    config_file.close()
+    return config_file.name
+
+def load_display(port, push, framebuffer):
+    extra = {}
+    if framebuffer:
+        # a file standing in for /dev/fb1
+        fake = tempfile.NamedTemporaryFile(suffix = '.fb', delete = False)
+        fake.write('\0' * 320 * 480 * 2)
+        fake.close()
+        extra = {'display': 'framebuffer', 'framebuffer': fake.name, 'touch_device': None}
+
+    config_path = write_config(port, push, **extra)
+    os.environ['OCTOPICONTROL_CONFIG'] = config_path
+
+    # the display finds its fonts next to the script it was started as
+    sys.argv[0] = os.path.join(src, 'octopicontrol.py')
+
+    import octopicontrol
+    os.unlink(config_path)
+    return octopicontrol
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def summarize(samples):
+    if not samples:
+        return None
+
+    return {
+        'count': len(samples),
+        'mean': round(1000 * sum(samples) / len(samples), 2),
+        'p50': round(1000 * percentile(samples, 0.5), 2),
+        'p95': round(1000 * percentile(samples, 0.95), 2),
+        'p99': round(1000 * percentile(samples, 0.99), 2),
+        'max': round(1000 * max(samples), 2)
+    }
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+class TouchProbe(threading.Thread):
+    # taps the screen every interval and times how long the loop takes to
+    # present a frame after each tap
+    def __init__(self, octopicontrol, interval, seconds):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.pygame = octopicontrol.pygame
+        self.interval = interval
+        self.seconds = seconds
+        self.tapped = None
+        self.latencies = []
+
+        renderer = octopicontrol.StatusRenderer
+        present = renderer.present
+
+        def timed_present(renderer_self):
+            present(renderer_self)
+            if self.tapped is not None:
+                self.latencies.append(time.time() - self.tapped)
+                self.tapped = None
+
+        renderer.present = timed_present
+
+    def run(self):
+        pygame = self.pygame
+        while pygame.display.get_surface() is None:
+            time.sleep(0.01)
+
+        started = time.time()
+        while time.time() - started < self.seconds:
+            time.sleep(self.interval)
+
+            self.tapped = time.time()
+            pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos = (160, 240), button = 1))
+            time.sleep(0.05)
+            pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONUP, pos = (160, 240), button = 1))
+
+        pygame.event.post(pygame.event.Event(pygame.QUIT))
+
+def bench_status(octopicontrol, seconds, touch_interval):
+    probe = TouchProbe(octopicontrol, touch_interval, seconds)
+    probe.start()
+
+    cpu = cpu_time()
+    started = time.time()
+    octopicontrol.main()
+    elapsed = time.time() - started
+    cpu = cpu_time() - cpu
+
+    frames = list(octopicontrol.profiler.samples.get('frame', []))
+    requests = octopicontrol.client.stats()
+
+    return {
+        'seconds': round(elapsed, 2),
+        'frames': len(frames),
+        'fps': round(len(frames) / elapsed, 2),
+        'cpu_per_frame_ms': round(1000 * cpu / max(1, len(frames)), 2),
+        'frame_time': summarize(frames),
+        'phases': dict((phase, summarize(list(samples))) for phase, samples in octopicontrol.profiler.samples.items()),
+        'requests': dict((endpoint, {
+            'count': timing['count'],
+            'errors': timing['errors'],
+            'mean_ms': round(1000 * timing['total'] / timing['count'], 2),
+            'max_ms': round(1000 * timing['max'], 2)
+        }) for endpoint, timing in requests.items()),
+        'touch_to_present': summarize(probe.latencies)
+    }
+
+def bench_startup(port, push, runs):
+    # a fresh interpreter per run, timed by the display's own log lines. the
+    # first run has no cached frame to show, the others do.
+    frame_cache = tempfile.mktemp(suffix = '.bmp')
+    config_path = write_config(port, push, frame_cache = frame_cache, log_level = 'INFO')
+    env = dict(os.environ, OCTOPICONTROL_CONFIG = config_path)
+    timings = {'first_frame': [], 'first_frame_cached': [], 'first_status': []}
+
+    for run in range(runs):
+        display = subprocess.Popen([sys.executable, os.path.join(src, 'octopicontrol.py')], env = env, stderr = subprocess.PIPE)
+        cached = os.path.exists(frame_cache)
+        status = None
+
+        for line in iter(display.stderr.readline, ''):
+            match = re.search(r"first (frame|status) (\d+) ms", line)
+            if match is None:
+                continue
+
+            seconds = int(match.group(2)) / 1000.0
+            if match.group(1) == 'status':
+                timings['first_status'].append(seconds)
+                break
+            elif cached:
+                timings['first_frame_cached'].append(seconds)
+            else:
+                timings['first_frame'].append(seconds)
+
+        # stopped the way the service is, so it leaves its last frame
+        # behind for the next run
+        display.terminate()
+        display.wait()
+
+    os.unlink(config_path)
+    if os.path.exists(frame_cache):
+        os.unlink(frame_cache)
+
+    return dict((name, summarize(samples)) for name, samples in timings.items())
+
+def bench_screensaver(octopicontrol, frames, densities):
+    pygame = octopicontrol.pygame
+    display = octopicontrol.display
+    screen = display.surface
+    font = pygame.font.Font(os.path.join(src, 'Fonts', 'NotoMono-Regular.ttf'), 15)
+    banner = "MP Mini Select V2 IIIP 3D Printer"
+    octopicontrol.glyph_atlas.prepare(font, banner + "0123456789:+-" + octopicontrol.clock.code())
+    results = {}
+
+    for density in densities:
+        rain = octopicontrol.MatrixRain(screen.get_size(), font, density, banner)
+        update = []
+        render = []
+        present = []
+
+        # let the rain fill the screen before measuring
+        for i in range(100):
+            rain.modernize()
+            for rect in rain.render(screen):
+                screen.fill((0, 0, 0), rect)
+
+        cpu = cpu_time()
+        started = time.time()
+
+        for i in range(frames):
+            t0 = time.time()
+            rain.modernize()
+            t1 = time.time()
+            rects = rain.render(screen)
+            t2 = time.time()
+            display.flip()
+            for rect in rects:
+                screen.fill((0, 0, 0), rect)
+            t3 = time.time()
+
+            update.append(t1 - t0)
+            render.append(t2 - t1)
+            present.append(t3 - t2)
+
+        elapsed = time.time() - started
+        cpu = cpu_time() - cpu
+
+        results[str(density)] = {
+            'characters': rain.count,
+            'max_fps': round(frames / elapsed, 2),
+            'cpu_per_frame_ms': round(1000 * cpu / frames, 2),
+            'update': summarize(update),
+            'render': summarize(render),
+            'present': summarize(present)
+        }
+
+    return results
+
+def report(results):
+    for name, summary in sorted(results['startup'].items()):
+        if summary is not None:
+            print("startup %-18s p50 %7.1f  max %7.1f ms" % (name, summary['p50'], summary['max']))
+
+    status = results['status']
+    print("status loop: %d frames in %ss, %.1f fps, %.2f ms cpu/frame" % (status['frames'], status['seconds'], status['fps'], status['cpu_per_frame_ms']))
+
+    for phase, summary in sorted(status['phases'].items()):
+        if summary is not None:
+            print("  %-14s p50 %7.2f  p95 %7.2f  max %7.2f ms" % (phase, summary['p50'], summary['p95'], summary['max']))
+
+    for endpoint, timing in sorted(status['requests'].items()):
+        print("  /api/%-10s %5d requests, %d errors, mean %.1f ms, max %.1f ms" % (endpoint, timing['count'], timing['errors'], timing['mean_ms'], timing['max_ms']))
+
+    touch = status['touch_to_present']
+    if touch is not None:
+        print("  touch to present: %d taps, p50 %.1f ms, max %.1f ms" % (touch['count'], touch['p50'], touch['max']))
+
+    for density, saver in sorted(results['screensaver'].items()):
+        print("screensaver x%s: %d characters, %.0f fps max, %.2f ms cpu/frame (update %.2f, render %.2f, present %.2f ms p50)" % (
+            density, saver['characters'], saver['max_fps'], saver['cpu_per_frame_ms'],
+            saver['update']['p50'], saver['render']['p50'], saver['present']['p50']))
+
+def compare(results, baseline):
+    print("\ncompared with baseline:")
+
+    def change(label, now, before):
+        if before:
+            print("  %-36s %9.2f -> %9.2f (%+.0f%%)" % (label, before, now, 100.0 * (now - before) / before))
+
+    if 'startup' in baseline:
+        for name, summary in sorted(results['startup'].items()):
+            if summary is not None and baseline['startup'].get(name):
+                change("startup %s ms" % name, summary['p50'], baseline['startup'][name]['p50'])
+
+    change("status fps", results['status']['fps'], baseline['status']['fps'])
+    change("status cpu ms/frame", results['status']['cpu_per_frame_ms'], baseline['status']['cpu_per_frame_ms'])
+
+    for density, saver in sorted(results['screensaver'].items()):
+        if density in baseline['screensaver']:
+            change("screensaver x%s cpu ms/frame" % density, saver['cpu_per_frame_ms'], baseline['screensaver'][density]['cpu_per_frame_ms'])
+
+def main():
+    parser = argparse.ArgumentParser(description = "Headless benchmark for octopicontrol.py")
+    parser.add_argument('--seconds', type = float, default = 15, help = "how long to run the status loop")
+    parser.add_argument('--port', type = int, default = 5077)
+    parser.add_argument('--latency', type = float, default = 0, help = "seconds the fake server adds to every request")
+    parser.add_argument('--failure-rate', type = float, default = 0, help = "fraction of requests the fake server fails")
+    parser.add_argument('--push', action = 'store_true', help = "use the SockJS push channel")
+    parser.add_argument('--framebuffer', action = 'store_true', help = "present through the mmap framebuffer display, into a file")
+    parser.add_argument('--touch-interval', type = float, default = 1.0, help = "seconds between simulated taps")
+    parser.add_argument('--startup-runs', type = int, default = 3, help = "times to start the display from scratch")
+    parser.add_argument('--saver-frames', type = int, default = 300)
+    parser.add_argument('--density', type = float, action = 'append', help = "screensaver densities to run, may be repeated")
+    parser.add_argument('--json', help = "write the results to this file")
+    parser.add_argument('--compare', help = "results file from an earlier run")
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.latency, args.failure_rate)
+
+    try:
+        startup = bench_startup(args.port, args.push, args.startup_runs)
+        octopicontrol = load_display(args.port, args.push, args.framebuffer)
+        results = {
+            'startup': startup,
+            'status': bench_status(octopicontrol, args.seconds, args.touch_interval),
+            'screensaver': bench_screensaver(octopicontrol, args.saver_frames, args.density or [1.0, 4.0])
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+    report(results)
+
+    if args.json:
+        with open(args.json, 'w') as results_file:
+            json.dump(results, results_file, indent = 2, sort_keys = True)
+
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            compare(results, json.load(baseline_file))
+
+if __name__ == '__main__': main()
@@ -0,0 +1,377 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Stand-in OctoPrint server for running octopicontrol.py without a printer.
+# It serves the REST endpoints the display uses, the SockJS push channel, the
+# job's G-code, a file list and webcam snapshots, and simulates a print job
+# that advances in real time.
+#
+# Point the display at it with {"url": "http://127.0.0.1:5000"} in
+# ~/.octopicontrol.json, then run: python fake_octoprint.py --port 5000
+
+import argparse
+import io
+import json
+import math
+import random
+import socket
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+def make_gcode(layers = 100, height = 0.2):
+    # a square base under a tube, enough for the preview to show layers
+    lines = ["; made by fake_octoprint.py", "G90", "M82", "G28", "G92 E0"]
+    e = 0.0
+    for layer in range(layers):
+        z = height * (layer + 1)
+        lines.append("G1 Z%.2f F600" % z)
+        if layer < layers // 4:
+            points = [(30, 30), (90, 30), (90, 90), (30, 90), (30, 30)]
+        else:
+            points = [(60 + 20 * math.cos(a * math.pi / 18), 60 + 20 * math.sin(a * math.pi / 18)) for a in range(37)]
+
+        lines.append("G0 X%.2f Y%.2f" % points[0])
+        for x, y in points[1:]:
+            e += 0.5
+            lines.append("G1 X%.2f Y%.2f E%.4f F1200" % (x, y, e))
+    lines.append("M84")
+    return "\n".join(lines) + "\n"
+
+def make_files(count):
+    # the job's file at the top and count more in a few folders
+    files = [{'type': 'machinecode', 'name': "Test_Part.gcode", 'path': "Test_Part.gcode", 'origin': 'local', 'date': 1500000000}]
+    folders = {}
+    for index in range(count):
+        folder = folders.setdefault("folder_%d" % (index % 10), [])
+        name = "part_%04d.gcode" % index
+        folder.append({'type': 'machinecode', 'name': name, 'path': "folder_%d/%s" % (index % 10, name), 'origin': 'local', 'size': 1000 + index, 'date': 1400000000 + index})
+
+    for name, children in sorted(folders.items()):
+        files.append({'type': 'folder', 'name': name, 'path': name, 'origin': 'local', 'children': children})
+    return files
+
+def make_snapshot(number, size):
+    # a frame with a bar that moves along with the frame number, as JPEG.
+    # pygame is only needed by the webcam, so only imported for it.
+    import pygame
+    frame = pygame.Surface(size)
+    frame.fill((30, 30, 40))
+    width = size[0] // 10
+    frame.fill((255, 96, 0), ((number * width // 2) % size[0], size[1] // 3, width, size[1] // 3))
+    frame.fill((0, 128, 255), (0, size[1] - 10, (number % 100) * size[0] // 100, 10))
+
+    snapshot = io.BytesIO()
+    pygame.image.save(frame, snapshot, 'snapshot.jpg')
+    return snapshot.getvalue()
+
+class FakePrinter(object):
+    def __init__(self, print_time, file_count = 0):
+        self.print_time = print_time
+        self.started = time.time()
+        self.state = "Printing"
+        self.file_name = "Test_Part.gcode"
+        self.gcode = make_gcode()
+        self.file_size = len(self.gcode)
+        self.files = make_files(file_count)
+        self.files[0]['size'] = self.file_size
+        self.lock = threading.Lock()
+
+    def progress(self):
+        elapsed = (time.time() - self.started) % self.print_time
+        return {
+            'completion': 100.0 * elapsed / self.print_time,
+            'filepos': int(self.file_size * elapsed / self.print_time),
+            'printTime': int(elapsed),
+            'printTimeLeft': int(self.print_time - elapsed)
+        }
+
+    def temperature(self):
+        return {
+            'tool0': {'actual': 210 + random.uniform(-1, 1), 'target': 210.0, 'offset': 0},
+            'bed': {'actual': 60 + random.uniform(-0.5, 0.5), 'target': 60.0, 'offset': 0}
+        }
+
+    def temperature_history(self, limit):
+        # OctoPrint only keeps a few minutes of history
+        now = int(time.time())
+        history = []
+        for t in range(now - min(limit, 300), now):
+            temps = self.temperature()
+            temps['time'] = t
+            history.append(temps)
+        return history
+
+    def job(self):
+        return {
+            'state': self.state,
+            'job': {
+                'file': {'name': self.file_name, 'path': self.file_name, 'origin': 'local', 'size': self.file_size, 'date': 1500000000},
+                'estimatedPrintTime': self.print_time
+            },
+            'progress': self.progress()
+        }
+
+    def current(self):
+        temps = self.temperature()
+        temps['time'] = int(time.time())
+
+        return {
+            'state': {'text': self.state, 'flags': {'printing': self.state == "Printing", 'paused': self.state == "Paused"}},
+            'job': self.job()['job'],
+            'progress': self.progress(),
+            'currentZ': None,
+            'offsets': {},
+            'temps': [temps],
+            'logs': [],
+            'messages': []
+        }
+
+    def select(self, path, command):
+        with self.lock:
+            if command.get('command') == 'select' and command.get('print'):
+                self.file_name = path.split('/')[-1]
+                self.state = "Printing"
+                self.started = time.time()
+
+    def command(self, command):
+        with self.lock:
+            if command.get('command') == 'cancel':
+                self.state = "Operational"
+            elif command.get('command') == 'pause':
+                if command.get('action') == 'resume':
+                    self.state = "Printing"
+                else:
+                    self.state = "Paused"
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections.add(self.connection)
+
+    def finish(self):
+        self.server.connections.discard(self.connection)
+        BaseHTTPRequestHandler.finish(self)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_json(self, data, status = 200):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_empty(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def read_body(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        printer = self.server.printer
+        path, query = (self.path.split('?', 1) + [''])[:2]
+        query = urlparse.parse_qs(query)
+
+        if random.random() < self.server.failure_rate:
+            self.send_empty(500)
+        elif path == '/api/version':
+            self.send_json({'api': '0.1', 'server': '1.3.12', 'text': 'OctoPrint (fake) 1.3.12'})
+        elif path == '/api/connection':
+            self.send_json({'current': {'state': printer.state, 'port': '/dev/ttyACM0', 'baudrate': 115200}})
+        elif path == '/api/job':
+            self.send_json(printer.job())
+        elif path == '/downloads/files/local/' + printer.file_name:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(printer.file_size))
+            self.end_headers()
+            for start in range(0, printer.file_size, 65536):
+                self.wfile.write(printer.gcode[start:start + 65536])
+        elif path == '/webcam/' and query.get('action') == ['snapshot']:
+            body = self.server.snapshot()
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif path == '/api/files':
+            # answered with 304 when the client has the current list
+            body = json.dumps({'files': printer.files, 'free': 1000000000})
+            etag = '"%x"' % (hash(body) & 0xffffffff)
+            if self.headers.getheader('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        elif path == '/api/printer':
+            temperature = printer.temperature()
+            if query.get('history') == ['true']:
+                temperature['history'] = printer.temperature_history(int(query.get('limit', ['300'])[0]))
+            self.send_json({'temperature': temperature, 'state': {'text': printer.state}})
+        else:
+            self.send_empty(404)
+
+    def do_POST(self):
+        printer = self.server.printer
+        path = self.path.split('?')[0]
+
+        if path.startswith('/sockjs/') and path.endswith('/xhr_streaming'):
+            self.stream()
+            return
+
+        body = self.read_body()
+        time.sleep(self.server.latency)
+
+        if path.startswith('/sockjs/') and path.endswith('/xhr_send'):
+            self.send_empty(204)
+        elif path == '/api/login':
+            self.send_json({'name': '_api', 'session': 'fakesession'})
+        elif path == '/api/job':
+            printer.command(json.loads(body))
+            self.server.wake()
+            self.send_empty(204)
+        elif path.startswith('/api/files/local/'):
+            printer.select(urlparse.unquote(path[len('/api/files/local/'):]), json.loads(body))
+            self.server.wake()
+            self.send_empty(204)
+        else:
+            self.send_empty(404)
+
+    def write_chunk(self, data):
+        self.wfile.write("%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def write_messages(self, *messages):
+        self.write_chunk('a' + json.dumps([json.dumps(message) for message in messages]) + '\n')
+
+    def stream(self):
+        # SockJS xhr-streaming: prelude, open frame, then message arrays
+        self.read_body()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/javascript; charset=UTF-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        try:
+            self.write_chunk('h' * 2048 + '\n')
+            self.write_chunk('o\n')
+            self.write_messages({'connected': {'version': '1.3.12', 'apikey': None}})
+            self.write_messages({'history': self.server.printer.current()})
+
+            heartbeat = time.time()
+            while not self.server.stopped.is_set():
+                self.server.changed.wait(self.server.push_interval)
+                if self.server.stopped.is_set():
+                    break
+
+                self.write_messages({'current': self.server.printer.current()})
+
+                if time.time() - heartbeat >= self.server.heartbeat:
+                    self.write_chunk('h\n')
+                    heartbeat = time.time()
+        except IOError:
+            pass
+
+        self.close_connection = True
+
+class FakeOctoPrint(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port = 5000, latency = 0, push_interval = 0.5, print_time = 3600, verbose = False, failure_rate = 0, file_count = 0, webcam_fps = 10, webcam_size = (640, 480)):
+        HTTPServer.__init__(self, ('127.0.0.1', port), FakeHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.push_interval = push_interval
+        self.heartbeat = 25
+        self.verbose = verbose
+        self.printer = FakePrinter(print_time, file_count)
+        self.stopped = threading.Event()
+        self.changed = threading.Event()
+        self.connections = set()
+        self.thread = None
+
+        # like a camera the snapshot only changes webcam_fps times a second,
+        # each frame is encoded once
+        self.webcam_fps = webcam_fps
+        self.webcam_size = webcam_size
+        self.webcam_frame = None
+        self.webcam_lock = threading.Lock()
+
+    def snapshot(self):
+        number = int(time.time() * self.webcam_fps)
+        with self.webcam_lock:
+            if self.webcam_frame is None or self.webcam_frame[0] != number:
+                self.webcam_frame = (number, make_snapshot(number, self.webcam_size))
+            return self.webcam_frame[1]
+
+    def handle_error(self, request, client_address):
+        # clients dropping their connection is expected, especially on stop
+        if not self.stopped.is_set():
+            HTTPServer.handle_error(self, request, client_address)
+
+    def wake(self):
+        # push state changes straight away instead of at the next interval
+        self.changed.set()
+        self.changed.clear()
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target = self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake()
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+        # drop keep-alive connections too, a stopped server must look down
+        for connection in list(self.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+def main():
+    parser = argparse.ArgumentParser(description = "Stand-in OctoPrint server")
+    parser.add_argument('--port', type = int, default = 5000)
+    parser.add_argument('--latency', type = float, default = 0, help = "seconds added to every request")
+    parser.add_argument('--failure-rate', type = float, default = 0, help = "fraction of GET requests answered with a 500")
+    parser.add_argument('--push-interval', type = float, default = 0.5, help = "seconds between pushed updates")
+    parser.add_argument('--print-time', type = int, default = 3600, help = "length of the simulated job in seconds")
+    parser.add_argument('--files', type = int, default = 0, help = "number of extra files to list")
+    parser.add_argument('--webcam-fps', type = float, default = 10, help = "frames per second of the snapshot webcam")
+    parser.add_argument('--verbose', action = 'store_true')
+    args = parser.parse_args()
+
+    server = FakeOctoPrint(args.port, args.latency, args.push_interval, args.print_time, args.verbose, args.failure_rate, args.files, args.webcam_fps)
+    print("Fake OctoPrint listening on http://127.0.0.1:%d" % args.port)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == '__main__': main()
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Renders a recording made with {"record": "print.jsonl.gz"} in
+# ~/.octopicontrol.json frame by frame, headless and as fast as it goes. The
+# same recording always gives the same frames, so a layout or renderer change
+# can be checked against an earlier run, and the time spent per frame can be
+# measured without a printer or a network.
+#
+#   python replay.py print.jsonl.gz --step 1 --frames before/
+#   python replay.py print.jsonl.gz --step 1 --compare before/
+#
+# Set {"replay": "print.jsonl.gz"} instead to run the display itself from a
+# recording, at {"replay_speed": 1.0} times real speed.
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+# must be set before pygame is imported
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+
+scripts = os.path.dirname(os.path.realpath(__file__))
+src = os.path.dirname(scripts)
+sys.path.insert(0, src)
+
+def load_display():
+    settings = {'apikey': 'replay', 'frame_cache': None, 'log_level': 'WARNING'}
+    config_file = tempfile.NamedTemporaryFile(suffix = '.json', delete = False)
+    json.dump(settings, config_file)
+    config_file.close()
+    os.environ['OCTOPICONTROL_CONFIG'] = config_file.name
+
+    # the display finds its fonts next to the script it was started as
+    sys.argv[0] = os.path.join(src, 'octopicontrol.py')
+
+    import octopicontrol
+    os.unlink(config_file.name)
+    return octopicontrol
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def replay(octopicontrol, path, url, step, frames_dir):
+    pygame = octopicontrol.pygame
+    pygame.display.init()
+    pygame.font.init()
+
+    display = octopicontrol.SdlDisplay((320, 480))
+    octopicontrol.display = display
+    renderer = octopicontrol.StatusRenderer(display.surface, octopicontrol.load_font(15), (0, 0, 0))
+    renderer.invalidate()
+
+    client = octopicontrol.ReplayClient(path, None, url)
+    cache = octopicontrol.ApiCache(octopicontrol.poll_intervals, client)
+    printer = octopicontrol.Printer(url or "replay", client, cache, 0)
+    printer.poller.push = client
+    client.on_push = printer.poller.apply_push
+    graph = octopicontrol.TempGraph(310, 110, printer.history, octopicontrol.config['temp_graph_span'])
+
+    # interface addresses would differ between machines
+    interfaces = [('eth0', '192.168.1.10', '00:00:00:00:00:00')]
+
+    timings = {'poll': [], 'layout': [], 'render': [], 'present': []}
+    manifest = []
+    now = 0.0
+
+    while True:
+        client.advance(now)
+
+        # every step is a fresh poll, as if the cache had timed out
+        t0 = time.time()
+        cache.invalidate('version', 'connection', 'printer', 'job')
+        printer.poller.publish(printer.poller.poll())
+        t1 = time.time()
+        lines = octopicontrol.status_lines(printer.poller.estimated(now), None, interfaces, 4, now, 5)
+        t2 = time.time()
+        for x, y, text in lines:
+            renderer.text(x, y, text, (255, 255, 255))
+        renderer.image(5, 362, graph.surface, graph.update(now))
+        t3 = time.time()
+        renderer.present()
+        t4 = time.time()
+
+        timings['poll'].append(t1 - t0)
+        timings['layout'].append(t2 - t1)
+        timings['render'].append(t3 - t2)
+        timings['present'].append(t4 - t3)
+
+        digest = hashlib.sha1(pygame.image.tostring(display.surface, 'RGB')).hexdigest()
+        if frames_dir is not None and (not manifest or manifest[-1][1] != digest):
+            pygame.image.save(display.surface, os.path.join(frames_dir, "%08.1f.png" % now))
+        manifest.append((round(now, 3), digest))
+
+        if client.finished():
+            break
+        now += step
+
+    return manifest, timings
+
+def compare(manifest, baseline):
+    differences = 0
+    for (now, digest), (before_now, before) in zip(manifest, baseline):
+        if digest != before:
+            print("  frame at %.1fs differs" % now)
+            differences += 1
+
+    if len(manifest) != len(baseline):
+        print("  %d frames, baseline has %d" % (len(manifest), len(baseline)))
+        differences += 1
+
+    return differences
+
+def main():
+    parser = argparse.ArgumentParser(description = "Render a recording of OctoPrint traffic frame by frame")
+    parser.add_argument('recording')
+    parser.add_argument('--url', help = "printer to replay when several were recorded")
+    parser.add_argument('--step', type = float, default = 1.0, help = "seconds of recording per frame")
+    parser.add_argument('--frames', help = "directory to save changed frames and their hashes in")
+    parser.add_argument('--compare', help = "directory of an earlier --frames run")
+    args = parser.parse_args()
+
+    if args.frames and not os.path.isdir(args.frames):
+        os.makedirs(args.frames)
+
+    octopicontrol = load_display()
+    manifest, timings = replay(octopicontrol, args.recording, args.url, args.step, args.frames)
+
+    print("%d frames, %d distinct" % (len(manifest), len(set(digest for now, digest in manifest))))
+    for phase in ['poll', 'layout', 'render', 'present']:
+        samples = timings[phase]
+        print("  %-8s p50 %7.2f  p95 %7.2f  max %7.2f ms" % (phase, 1000 * percentile(samples, 0.5), 1000 * percentile(samples, 0.95), 1000 * max(samples)))
+
+    if args.frames:
+        with open(os.path.join(args.frames, 'manifest.json'), 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+
+    if args.compare:
+        with open(os.path.join(args.compare, 'manifest.json'), 'r') as baseline_file:
+            differences = compare(manifest, json.load(baseline_file))
+        print("%d differences" % differences)
+        sys.exit(1 if differences else 0)
+
+if __name__ == '__main__': main()
@@ -1,635 +1,3805 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-# This script requires that libsdl be downgraded to version 1.2
+# This script requires that libsdl be downgraded to version 1.2, unless
+# "display" is set to "framebuffer" in ~/.octopicontrol.json
 # See here: https://learn.adafruit.com/adafruit-pitft-28-inch-resistive-touchscreen-display-raspberry-pi/pitft-pygame-tips
 # To calibrate touchscreen, use the following command: sudo TSLIB_FBDEVICE=/dev/fb1 TSLIB_TSDEVICE=/dev/input/touchscreen ts_calibrate
 # Screen rotation can be adjusted using https://raw.githubusercontent.com/adafruit/Raspberry-Pi-Installer-Scripts/master/adafruit-pitft.sh
 
+import base64
+import bisect
+import ctypes
 import fcntl
+import gzip
+import hashlib
+import io
 import json
+import logging
+import mmap
 import os
 import pygame
 import random
-import requests
+import select
 import signal
 import socket
 import struct
 import sys
+import textwrap
+import threading
 import time
+import urllib
+import urlparse
+import zlib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from collections import deque, namedtuple, OrderedDict
+from array import array
 from datetime import datetime
 from os.path import expanduser
-from pytz import timezone
 from pygame.locals import *
 
-# required environment variables for pygame
-os.putenv('SDL_VIDEODRIVER', 'fbcon')
-os.putenv('SDL_FBDEV', '/dev/fb1')
-os.putenv('SDL_MOUSEDRV', 'TSLIB')
-os.putenv('SDL_MOUSEDEV', '/dev/input/touchscreen')
+# startup is measured from here when /proc can't say when the process began
+import_started = time.time()
 
-default_timezone = "US/Central";
+home = expanduser("~")
+
+# defaults, any of which can be overridden in ~/.octopicontrol.json or the
+# file named by OCTOPICONTROL_CONFIG
+config = {
+    'url': 'http://octopi.inditech.org',
+    'apikey': None,
+    'name': 'OctoPrint',
+    'timezone': 'US/Central',
+    'printers': None,
+    'connect_timeout': 3.05,
+    'read_timeout': 10,
+    'keep_alive': True,
+    'push': False,
+    'push_retry': 10,
+    'offline_after': 3,
+    'job_interval': 15,
+    'backoff_max': 30,
+    'text_cache_size': 128,
+    'interfaces': None,
+    'interface_refresh': 60,
+    'screensaver_after': 48,
+    'screensaver_density': 1.0,
+    'power_mode': 'matrix',
+    'backlight': '/sys/class/backlight/soc:backlight/brightness',
+    'dim_after': 60,
+    'dim_level': 0.25,
+    'off_after': 300,
+    'dark_hours': None,
+    'temp_history': 4 * 3600,
+    'temp_graph_span': 1800,
+    'preview': False,
+    'preview_bed': [120, 120],
+    'preview_cache': home + '/.octopicontrol-previews',
+    'file_cache': home + '/.octopicontrol-files',
+    'webcam': False,
+    'webcam_url': None,
+    'webcam_fps': 2,
+    'status_port': None,
+    'status_bind': '127.0.0.1',
+    'profile': False,
+    'profile_overlay': False,
+    'profile_log': None,
+    'profile_interval': 60,
+    'profile_window': 300,
+    'frame_cache': home + '/.octopicontrol.bmp',
+    'record': None,
+    'replay': None,
+    'replay_speed': 1.0,
+    'controls': False,
+    'display': 'sdl',
+    'framebuffer': '/dev/fb1',
+    'touch_device': '/dev/input/touchscreen',
+    'touch_swap_xy': False,
+    'touch_invert_x': False,
+    'touch_invert_y': False,
+    'debounce': 0.15,
+    'log_level': 'WARNING'
+}
+
+config_path = os.environ.get('OCTOPICONTROL_CONFIG', home + '/.octopicontrol.json')
+if os.path.exists(config_path):
+    with open(config_path, 'r') as config_file:
+        config.update(json.load(config_file))
+
+# with a printers list every entry may carry its own key
+if config['apikey'] is None and (not config['printers'] or os.path.exists(home + '/.octoprint_apikey')):
+    with open(home + '/.octoprint_apikey', 'r') as apikey:
+        config['apikey'] = apikey.read().replace('\n', '')
+
+dat_key = config['apikey']
+
+# required environment variables for pygame. anything already set in the
+# environment wins, so e.g. SDL_VIDEODRIVER=dummy runs without the display.
+# the framebuffer display only needs SDL for events and timers.
+if config['display'] == 'framebuffer':
+    sdl_settings = [('SDL_VIDEODRIVER', 'dummy')]
+else:
+    sdl_settings = [('SDL_VIDEODRIVER', 'fbcon'),
+                    ('SDL_FBDEV', '/dev/fb1'),
+                    ('SDL_MOUSEDRV', 'TSLIB'),
+                    ('SDL_MOUSEDEV', '/dev/input/touchscreen')]
+
+for name, value in sdl_settings:
+    if name not in os.environ:
+        os.putenv(name, value)
+
+log = logging.getLogger('octopicontrol')
+
+########## start text cache classes ##########
+#
+# rasterizing text is one of the most expensive things a frame does, and
+# most frames draw the same strings as the last one. rendered surfaces are
+# kept in a bounded LRU cache, and the screensaver draws from an atlas of
+# every glyph at every fade level.
+
+class TextCache(object):
+    def __init__(self, size):
+        self.size = size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, antialias, color):
+        key = (font, text, tuple(color), antialias)
+
+        surface = self.surfaces.pop(key, None)
+        if surface is None:
+            self.misses += 1
+            surface = font.render(text, antialias, color)
+
+            if len(self.surfaces) >= self.size:
+                self.surfaces.popitem(last=False)
+        else:
+            self.hits += 1
+
+        # re-inserting moves the entry to the most recently used end
+        self.surfaces[key] = surface
+        return surface
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.surfaces)}
+
+def fade_color(life, max_life, fade_time):
+    if life > fade_time:
+        return [ 0 , 0 , int(255*(float(life-fade_time)/(max_life-fade_time))) ]
+    else:
+        return [ 100 , int(100*(float(life)/fade_time)) , 255 ]
+
+class GlyphAtlas(object):
+    def __init__(self, max_life, fade_time):
+        self.max_life = max_life
+        self.fade_time = fade_time
+        self.glyphs = {}
+        self.hits = 0
+        self.misses = 0
+
+    def prepare(self, font, chars):
+        # render every fade level up front so the animation never has to
+        for char in set(chars):
+            for life in range(self.max_life + 1):
+                self.glyph(font, char, life)
+
+    def glyph(self, font, char, life):
+        key = (font, char, life)
+
+        surface = self.glyphs.get(key)
+        if surface is None:
+            self.misses += 1
+            surface = font.render(char, False, fade_color(life, self.max_life, self.fade_time))
+            self.glyphs[key] = surface
+        else:
+            self.hits += 1
+
+        return surface
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.glyphs)}
+
+text_cache = TextCache(config['text_cache_size'])
+glyph_atlas = GlyphAtlas(30, 5)
+########## end text cache classes ##########
+
+########## start profiler classes ##########
+#
+# times each phase of a frame by lapping a stopwatch, keeping a rolling
+# window of samples per phase. when disabled every call returns at once,
+# so it can stay in place on production units.
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class FrameProfiler(object):
+    def __init__(self, enabled, window, log_path, interval):
+        self.enabled = enabled
+        self.window = window
+        self.log_path = log_path
+        self.interval = interval
+        self.samples = {}
+        self.counters = {}
+        self.started = 0
+        self.last = 0
+        self.dumped = time.time()
+        self.overlays = {}
+
+    def begin(self):
+        if not self.enabled:
+            return
+
+        self.started = self.last = time.time()
+
+    def lap(self, phase):
+        if not self.enabled:
+            return
+
+        now = time.time()
+        self.record(phase, now - self.last)
+        self.last = now
+
+    def end(self, phase):
+        if not self.enabled:
+            return
+
+        now = time.time()
+        self.record(phase, now - self.started)
+
+        if now - self.dumped >= self.interval:
+            self.dump(now)
+            self.dumped = now
+
+    def record(self, phase, elapsed):
+        if not self.enabled:
+            return
+
+        # deque appends are atomic, so the poller thread can record too
+        samples = self.samples.get(phase)
+        if samples is None:
+            samples = self.samples.setdefault(phase, deque(maxlen=self.window))
+
+        samples.append(elapsed)
+
+    def summary(self):
+        summary = {}
+
+        for phase, samples in list(self.samples.items()):
+            samples = list(samples)
+            if samples:
+                summary[phase] = {
+                    'count': len(samples),
+                    'p50': round(percentile(samples, 0.5) * 1000, 2),
+                    'p95': round(percentile(samples, 0.95) * 1000, 2),
+                    'p99': round(percentile(samples, 0.99) * 1000, 2),
+                    'max': round(max(samples) * 1000, 2)
+                }
+
+        return summary
+
+    def overlay_lines(self, phases):
+        # refreshed once a second so the numbers stay readable
+        now = time.time()
+        updated, overlay = self.overlays.get(tuple(phases), (0, []))
+
+        if now - updated >= 1:
+            summary = self.summary()
+            overlay = ["phase      p50   p95   max"]
+
+            for phase in phases:
+                if phase in summary:
+                    overlay.append("%-8s %5.1f %5.1f %5.1f" % (phase[:8], summary[phase]['p50'], summary[phase]['p95'], summary[phase]['max']))
+
+            self.overlays[tuple(phases)] = (now, overlay)
+
+        return overlay
+
+    def dump(self, now):
+        record = {
+            'time': now,
+            'phases': self.summary(),
+            'counters': dict(self.counters),
+            'text_cache': text_cache.stats(),
+            'glyph_atlas': glyph_atlas.stats()
+        }
+
+        if self.log_path:
+            with open(self.log_path, 'a') as profile_log:
+                profile_log.write(json.dumps(record) + "\n")
+        else:
+            log.info("frame profile %s", json.dumps(record))
+
+profiler = FrameProfiler(config['profile'], config['profile_window'], config['profile_log'], config['profile_interval'])
+########## end profiler classes ##########
+
+########## start clock classes ##########
+#
+# the timezone is looked up once and the time is formatted at most once a
+# second. the status screen and the screensaver both read it from here.
+
+class Clock(object):
+    def __init__(self, zone):
+        self.zone_name = zone
+        self.zone = None
+        self.second = None
+        self.current = None
+        self.text = None
+
+    def now(self):
+        second = int(time.time())
+        if second != self.second:
+            if self.zone is None:
+                # pytz loads its zone database on import, leave that until
+                # the clock is first shown
+                import pytz
+                self.zone = pytz.timezone(self.zone_name)
+
+            self.current = datetime.fromtimestamp(second, self.zone)
+            self.text = self.current.strftime('%X %Z %z') + self.zone_name
+            self.second = second
+
+        return self.current
+
+    def code(self):
+        self.now()
+        return self.text
+
+clock = Clock(config['timezone'])
+########## end clock classes ##########
+
+########## start screen saver classes ##########
+#
+# Matrix code borrowed and modified from Dylan J. Raub (dylanjraub)
+# http://pygame.org/project-Matrix+code-756-.html
+#
+# the rain is kept as parallel arrays instead of one object per character.
+# columns live in slots that are reused once all of their characters have
+# faded, and characters are compacted in place as they die, so a frame is
+# a couple of tight loops plus one batch of blits from the glyph atlas.
+
+def matrix_code():
+    # "matrix code" is a string made up of the current timezone/time/date
+    code = list(clock.code())
+    random.shuffle(code, random.random)
+    return code
+
+class MatrixRain(object):
+    def __init__(self, size, font, density, banner):
+        self.width = size[0]
+        self.height = size[1]
+        self.font = font
+        self.density = density
+        self.banner = banner
+        self.text_width = 13
+        self.line_height = font.get_height()
+        self.spawn = 0.0
+
+        # glyphs are drawn centred on their position
+        glyph_size = font.size('M')
+        self.offset = (glyph_size[0] / 2, glyph_size[1] / 2)
+
+        # each character's surfaces indexed by remaining life
+        self.fades = {}
+
+        # columns, indexed by slot. a speed of 0 marks a lone character
+        self.codes = []
+        self.free = []
+        self.col_x = array('h')
+        self.col_y = array('h')
+        self.col_speed = array('b')
+        self.col_update = array('b')
+        self.col_frame = array('h')
+        self.col_count = array('h')
+
+        # characters, the first self.count entries are alive. frames count
+        # in tenths so they stay exact in an integer array
+        self.count = 0
+        self.x = array('h')
+        self.y = array('h')
+        self.life = array('b')
+        self.frame = array('h')
+        self.column = array('H')
+
+    def add_column(self, x, y, speed, code):
+        for char in code:
+            if char not in self.fades:
+                self.fades[char] = [glyph_atlas.glyph(self.font, char, life) for life in range(glyph_atlas.max_life + 1)]
+
+        if self.free:
+            slot = self.free.pop()
+            self.codes[slot] = code
+            self.col_x[slot] = x
+            self.col_y[slot] = y
+            self.col_speed[slot] = speed
+            self.col_update[slot] = 0
+            self.col_frame[slot] = 0
+            self.col_count[slot] = 0
+        else:
+            slot = len(self.codes)
+            self.codes.append(code)
+            self.col_x.append(x)
+            self.col_y.append(y)
+            self.col_speed.append(speed)
+            self.col_update.append(0)
+            self.col_frame.append(0)
+            self.col_count.append(0)
+
+        return slot
+
+    def add_char(self, x, y, frame, slot):
+        if self.count == len(self.x):
+            self.x.append(0)
+            self.y.append(0)
+            self.life.append(0)
+            self.frame.append(0)
+            self.column.append(0)
+
+        i = self.count
+        self.x[i] = x
+        self.y[i] = y
+        self.life[i] = glyph_atlas.max_life
+        self.frame[i] = frame * 10
+        self.column[i] = slot
+        self.count += 1
+        self.col_count[slot] += 1
+
+    def spawn_columns(self):
+        self.spawn += self.density / 2.0
+
+        while self.spawn >= 1:
+            self.spawn -= 1
+
+            if random.randint(0,20) == 0:
+                speed = 3
+            else:
+                speed = random.randint(1,2)
+
+            x = random.randint(1, self.width // self.text_width) * self.text_width - self.text_width // 2
+            slot = self.add_column(x, -self.line_height, speed, matrix_code())
+            self.add_char(x, -self.line_height, 0, slot)
+
+        if random.randint(0, 50) == 50:
+            code = list(self.banner)
+            random.shuffle(code, random.random)
+
+            x = random.randint(1, self.width // self.text_width + 1) * self.text_width - self.text_width // 2
+            y = random.randint(1, self.height // self.line_height + 1) * self.line_height
+            slot = self.add_column(x, y, 0, code)
+            self.add_char(x, y, random.randint(0, len(code)-1), slot)
+
+    def modernize(self):
+        self.spawn_columns()
+
+        codes = self.codes
+        col_y = self.col_y
+        col_speed = self.col_speed
+        col_update = self.col_update
+        col_frame = self.col_frame
+        col_count = self.col_count
+
+        # falling columns drop a new character every `speed` frames
+        for slot in range(len(codes)):
+            code = codes[slot]
+            if code is None:
+                continue
+
+            speed = col_speed[slot]
+            if speed:
+                col_update[slot] += 1
+                if col_update[slot] == speed:
+                    col_update[slot] = 0
+                    if col_y[slot] < self.height:
+                        col_y[slot] += self.line_height
+                        self.add_char(self.col_x[slot], col_y[slot], col_frame[slot], slot)
+
+            col_frame[slot] += 1
+            if col_frame[slot] >= len(code):
+                col_frame[slot] = 0
+
+        # age every character and compact the survivors to the front
+        xs = self.x
+        ys = self.y
+        lives = self.life
+        frames = self.frame
+        columns = self.column
+        rand = random.random
+        write = 0
+
+        for read in range(self.count):
+            slot = columns[read]
+            life = lives[read] - 1
+            if life <= 0:
+                col_count[slot] -= 1
+                continue
+
+            frame = frames[read] + 1 + int(rand() * 3)
+            if frame >= len(codes[slot]) * 10:
+                frame = 0
+
+            xs[write] = xs[read]
+            ys[write] = ys[read]
+            lives[write] = life
+            frames[write] = frame
+            columns[write] = slot
+            write += 1
+
+        self.count = write
+
+        # a column is finished once it is off screen and fully faded
+        for slot in range(len(codes)):
+            if codes[slot] is not None and col_count[slot] == 0 and (col_speed[slot] == 0 or col_y[slot] >= self.height):
+                codes[slot] = None
+                self.free.append(slot)
+
+    def render(self, screen):
+        fades = self.fades
+        codes = self.codes
+        xs = self.x
+        ys = self.y
+        lives = self.life
+        frames = self.frame
+        columns = self.column
+        ox, oy = self.offset
+
+        glyphs = [(fades[codes[columns[i]][frames[i] // 10]][lives[i]], (xs[i] - ox, ys[i] - oy)) for i in range(self.count)]
+
+        # Surface.blits only exists from pygame 1.9.4
+        if hasattr(screen, 'blits'):
+            return screen.blits(glyphs)
+        else:
+            return [screen.blit(glyph, pos) for glyph, pos in glyphs]
+########## end screen saver classes ##########
+
+def get_script_path():
+    return os.path.dirname(os.path.realpath(sys.argv[0]))
+
+# every screen shares the fonts, each size is only loaded once
+fonts = {}
+
+def load_font(size, name="NotoMono-Regular.ttf"):
+    font = fonts.get((name, size))
+    if font is None:
+        font = pygame.font.Font(get_script_path() + "/Fonts/" + name, size)
+        fonts[(name, size)] = font
+    return font
+
+def process_age():
+    # seconds since the process was started, interpreter start up included
+    try:
+        with open('/proc/self/stat', 'r') as stat:
+            started = float(stat.read().rsplit(')', 1)[1].split()[19]) / os.sysconf('SC_CLK_TCK')
+        with open('/proc/uptime', 'r') as uptime:
+            return float(uptime.read().split()[0]) - started
+    except (IOError, OSError, ValueError, IndexError):
+        return time.time() - import_started
+
+def getIPAddr(ifname, s=None):
+    retval = ""
+    sock = s or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    
+    try:
+        retval = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), 0x8915, struct.pack('256s', ifname[:15]))[20:24])
+    except:
+        retval = None
+    finally:
+        if s is None:
+            sock.close()
+        
+    if retval == None:
+        return "000.000.000.000"
+    else:
+        return retval
+
+def getHWAddr(ifname, s=None):
+    retval = ""
+    sock = s or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    
+    try:
+        info = fcntl.ioctl(sock.fileno(), 0x8927,  struct.pack('256s', ifname[:15]))
+        retval = ''.join(['%02x:' % ord(char) for char in info[18:24]])[:-1]
+    except:
+        retval = None
+    finally:
+        if s is None:
+            sock.close()
+    
+    if retval == None:
+        return "00:00:00:00:00:00"
+    else:
+        return retval
+
+########## start network interface classes ##########
+#
+# interface addresses rarely change, so they are read into memory and only
+# re-read when the kernel announces a change over rtnetlink. MAC addresses
+# are read once per interface. where netlink isn't available a slow timer
+# refreshes the addresses instead.
+
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+
+class InterfaceCache(threading.Thread):
+    def __init__(self, names, refresh):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.names = names
+        self.refresh = refresh
+        self.macs = {}
+        self.stopped = threading.Event()
+
+        # (name, ip, mac) tuples, replaced whole on every reload
+        self.interfaces = ()
+        self.reload()
+
+    def discover(self):
+        if self.names:
+            return self.names
+
+        try:
+            names = [name for name in os.listdir('/sys/class/net') if name != 'lo']
+        except OSError:
+            names = ['wlan0', 'eth0']
+
+        # wireless first, the way the status screen has always listed them
+        return sorted(names, key=lambda name: (not name.startswith('wlan'), name))
+
+    def reload(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        interfaces = []
+
+        try:
+            for name in self.discover():
+                if name not in self.macs:
+                    self.macs[name] = getHWAddr(name, s)
+
+                interfaces.append((name, getIPAddr(name, s), self.macs[name]))
+        finally:
+            s.close()
+
+        self.interfaces = tuple(interfaces)
+
+    def run(self):
+        try:
+            netlink = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            netlink.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+        except (AttributeError, socket.error) as e:
+            log.info("rtnetlink unavailable, refreshing interfaces every %ds: %s", self.refresh, e)
+            netlink = None
+
+        while not self.stopped.is_set():
+            if netlink is None:
+                self.stopped.wait(self.refresh)
+            else:
+                # the timeout doubles as the fallback refresh
+                netlink.settimeout(self.refresh)
+                try:
+                    netlink.recv(65536)
+                except socket.timeout:
+                    pass
+
+            self.reload()
+
+        if netlink is not None:
+            netlink.close()
+
+    def stop(self):
+        self.stopped.set()
+########## end network interface classes ##########
+
+def headers(apikey):
+    headers = {
+        'Content-Type': 'application/json',
+	'X-Api-Key': apikey
+    }
+
+    return headers
+
+def ctrl_c(signal, frame):
+    # let main() stop its threads and keep its last frame
+    try:
+        pygame.event.post(pygame.event.Event(QUIT))
+    except pygame.error:
+        pygame.quit()
+        sys.exit(1)
+
+########## start connection health classes ##########
+#
+# every request reports to a small state machine. a few failures in a row
+# take the printer offline, after which only a cheap probe is sent, backing
+# off exponentially with jitter until the server answers again.
+
+ONLINE = 'online'
+DEGRADED = 'degraded'
+OFFLINE = 'offline'
+
+class ConnectionHealth(object):
+    def __init__(self, offline_after, backoff_max, backoff_min=1.0):
+        self.offline_after = offline_after
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.state = ONLINE
+        self.failures = 0
+        self.backoff = backoff_min
+        self.next_probe = 0
+        self.lock = threading.Lock()
+
+    def success(self):
+        with self.lock:
+            if self.state == OFFLINE:
+                log.warning("server is back online")
+
+            self.state = ONLINE
+            self.failures = 0
+            self.backoff = self.backoff_min
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+
+            if self.state == OFFLINE:
+                self.backoff = min(self.backoff * 2, self.backoff_max)
+            elif self.failures >= self.offline_after:
+                log.warning("server is offline after %d failed requests", self.failures)
+                self.state = OFFLINE
+                self.backoff = self.backoff_min
+            else:
+                self.state = DEGRADED
+
+            # jitter keeps a room full of displays from probing in lockstep
+            self.next_probe = time.time() + self.backoff * random.uniform(0.5, 1.0)
+
+    def should_probe(self):
+        return time.time() >= self.next_probe
+########## end connection health classes ##########
+
+########## start record and replay classes ##########
+#
+# with "record" set every request and pushed message is appended to a
+# gzipped file of JSON lines, after a header line with the wall clock time
+# the recording started. ReplayClient stands in for OctoClient and answers
+# from such a file, at real speed, faster, or stepped by hand with
+# advance(), so a long print can be rerun through the display.
+
+class Recorder(object):
+    def __init__(self, path, flush_interval=10):
+        self.file = gzip.open(path, 'wb')
+        self.started = time.time()
+        self.flush_interval = flush_interval
+        self.flushed = self.started
+        self.lock = threading.Lock()
+        self.file.write(json.dumps({'started': self.started}) + '\n')
+
+    def write(self, url, method, api_path, status_code, body, data=None):
+        record = {'t': round(time.time() - self.started, 3), 'u': url, 'm': method, 'p': api_path, 's': status_code, 'b': body}
+        if data is not None:
+            record['d'] = json.loads(data)
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+
+        with self.lock:
+            # threads still finishing a request while the display quits
+            if self.file.closed:
+                return
+            self.file.write(line)
+
+            # flushing ends a compressed block, so not for every line
+            if time.time() - self.flushed >= self.flush_interval:
+                self.file.flush()
+                self.flushed = time.time()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+recorder = None
+if config['record']:
+    recorder = Recorder(config['record'])
+
+def shift_times(body, delta):
+    # temperature samples carry the time they were taken, move them to
+    # when they are replayed
+    if isinstance(body, dict):
+        return dict((key, value + delta if key == 'time' else shift_times(value, delta)) for key, value in body.items())
+    elif isinstance(body, list):
+        return [shift_times(value, delta) for value in body]
+    return body
+
+def read_records(path):
+    # a recording the display never closed, after a crash or a power cut,
+    # has no gzip trailer. everything up to its last flush is still read,
+    # gzip.open would give up on the whole file.
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    rest = ''
+
+    with open(path, 'rb') as recording:
+        while True:
+            chunk = recording.read(65536)
+            if not chunk:
+                break
+
+            try:
+                lines = (rest + decompressor.decompress(chunk)).split('\n')
+            except zlib.error as e:
+                log.warning("%s is damaged, replaying what comes before: %s", path, e)
+                break
+
+            # the last piece is the start of a line still to come
+            rest = lines.pop()
+            for line in lines:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    log.warning("%s ends in a damaged line", path)
+                    return
+
+class ReplayClient(object):
+    def __init__(self, path, speed=1.0, url=None):
+        records = read_records(path)
+        self.epoch = next(records)['started']
+        self.records = [record for record in records if url is None or record['u'] == url]
+
+        self.url = url or path
+        self.base_url = self.url
+        self.timeout = (0, 0)
+        self.health = ConnectionHealth(config['offline_after'], config['backoff_max'])
+        self.session = None
+        self.timings = {}
+
+        # None steps by hand, see advance()
+        self.speed = speed
+        self.started = None
+        self.clock = 0.0
+
+        self.position = 0
+        self.answers = {}
+        self.last_push = None
+        self.on_push = None
+        self.lock = threading.Lock()
+
+    def now(self):
+        # what the display takes for the current time
+        if self.speed is None:
+            return self.clock
+        return time.time()
+
+    def length(self):
+        if self.records:
+            return self.records[-1]['t']
+        return 0
+
+    def finished(self):
+        return self.position >= len(self.records)
+
+    def advance(self, until):
+        # everything recorded up to until becomes the current state
+        self.clock = until
+        while self.position < len(self.records) and self.records[self.position]['t'] <= until:
+            record = self.records[self.position]
+            self.position += 1
+
+            delta = self.now() - (self.epoch + record['t'])
+            if record['m'] == 'PUSH':
+                self.last_push = self.now()
+                if self.on_push is not None:
+                    self.on_push(shift_times(record['b'], delta))
+            elif record['m'] == 'GET':
+                self.answers[record['p']] = (record['s'], shift_times(record['b'], delta))
+
+    def request(self, method, api_path, data=None):
+        with self.lock:
+            if self.speed is not None:
+                if self.started is None:
+                    self.started = time.time()
+                self.advance((time.time() - self.started) * self.speed)
+
+            answer = self.answers.get(api_path)
+
+        # commands aren't sent anywhere, and before the recording first
+        # asked for something there is nothing to say about the server
+        if method != 'GET' or answer is None:
+            return None
+
+        status_code, body = answer
+
+        if status_code is None or status_code >= 500:
+            self.health.failure()
+        else:
+            self.health.success()
+
+        if status_code == 200:
+            return body
+        return None
+
+    def get(self, api_path):
+        return self.request('GET', api_path)
+
+    def post(self, api_path, command):
+        return self.request('POST', api_path, json.dumps(command))
+
+    def revalidate(self, api_path, etag, last_modified):
+        return self.get(api_path), None, None
+
+    def stats(self):
+        return {}
+
+    def connect(self):
+        return None
+
+    def download(self, origin, path):
+        return None
+
+    # also stands in for the PushListener when the recording has pushes
+    def live(self):
+        return self.last_push is not None and self.now() - self.last_push < push_timeout
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+########## end record and replay classes ##########
+
+########## start api client classes ##########
+#
+# one client owns a pooled keep-alive session for all API traffic, with
+# timeouts so a hung server can't stall the poller forever
+
+# requests takes a good while to import on a Pi, so it is loaded by the
+# first thread that talks to a server, once the first frame is up
+requests = None
+
+def load_requests():
+    global requests
+    if requests is None:
+        import requests
+    return requests
+
+class OctoClient(object):
+    def __init__(self, url, apikey, connect_timeout, read_timeout, keep_alive=True):
+        self.url = url.rstrip('/')
+        self.base_url = self.url + '/api/'
+        self.timeout = (connect_timeout, read_timeout)
+        self.health = ConnectionHealth(config['offline_after'], config['backoff_max'])
+        self.timings = {}
+        self.lock = threading.Lock()
+        self.apikey = apikey
+        self.keep_alive = keep_alive
+        self.session = None
+
+    def connect(self):
+        # the session is made by the first request, not at start up
+        with self.lock:
+            if self.session is None:
+                load_requests()
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+
+                # headers are the same for every request, build them once
+                session.headers.update(headers(self.apikey))
+
+                # lets the pooled and unpooled latency be compared
+                if not self.keep_alive:
+                    session.headers['Connection'] = 'close'
+
+                self.session = session
+
+        return self.session
+
+    def now(self):
+        return time.time()
+
+    def record(self, method, api_path, elapsed, status_code):
+        endpoint = api_path.split('?')[0]
+
+        with self.lock:
+            timing = self.timings.setdefault(endpoint, {'count': 0, 'errors': 0, 'total': 0.0, 'last': 0.0, 'max': 0.0})
+            timing['count'] += 1
+            timing['total'] += elapsed
+            timing['last'] = elapsed
+            timing['max'] = max(timing['max'], elapsed)
+            if status_code is None or status_code >= 400:
+                timing['errors'] += 1
+
+        log.debug("%s %s -> %s in %.1fms", method, api_path, status_code, elapsed * 1000)
+
+    def stats(self):
+        with self.lock:
+            return dict((endpoint, dict(timing)) for endpoint, timing in self.timings.items())
+
+    def send(self, method, api_path, data=None, headers=None):
+        # the raw response, None when the server couldn't be reached
+        session = self.connect()
+        started = time.time()
+
+        try:
+            response = session.request(method, self.base_url + api_path, data=data, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            self.record(method, api_path, time.time() - started, None)
+            self.health.failure()
+            log.info("%s %s failed: %s", method, api_path, e)
+            if recorder is not None:
+                recorder.write(self.url, method, api_path, None, None, data)
+            return None
+
+        self.record(method, api_path, time.time() - started, response.status_code)
+
+        # 4xx answers such as 409 while the printer is disconnected still
+        # mean the server is up
+        if response.status_code >= 500:
+            self.health.failure()
+        else:
+            self.health.success()
+
+        return response
+
+    def decode(self, method, api_path, response, data=None):
+        body = None
+        if response.status_code == 200:
+            body = json.loads(response.content.decode('utf-8'))
+
+        if recorder is not None:
+            recorder.write(self.url, method, api_path, response.status_code, body, data)
+
+        return body
+
+    def request(self, method, api_path, data=None):
+        response = self.send(method, api_path, data)
+        if response is None:
+            return None
+
+        return self.decode(method, api_path, response, data)
+
+    def get(self, api_path):
+        return self.request('GET', api_path)
+
+    def revalidate(self, api_path, etag, last_modified):
+        # a GET that is only answered in full when the answer changed since
+        # the one the validators came with. the body is None when it didn't
+        # or the server couldn't be reached.
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+
+        response = self.send('GET', api_path, headers=headers)
+        if response is None:
+            return None, etag, last_modified
+
+        body = self.decode('GET', api_path, response)
+        if body is None:
+            return None, etag, last_modified
+
+        return body, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+    def post(self, api_path, command):
+        return self.request('POST', api_path, json.dumps(command))
+
+    def download(self, origin, path):
+        # a job's file as a streamed response, None when it can't be had.
+        # files on the printer's SD card can't be downloaded at all.
+        session = self.connect()
+
+        try:
+            response = session.get(self.url + '/downloads/files/' + origin + '/' + urllib.quote(path.encode('utf-8')), stream=True, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            log.info("download of %s failed: %s", path, e)
+            return None
+
+        if response.status_code != 200:
+            log.info("download of %s failed: %s", path, response.status_code)
+            response.close()
+            return None
+
+        return response
+
+client = OctoClient(config['url'], dat_key, config['connect_timeout'], config['read_timeout'], config['keep_alive'])
+########## end api client classes ##########
+
+########## start status poller classes ##########
+#
+# the OctoPrint API is polled on a worker thread so the display loop never
+# waits on the network. each round of polling is published as an immutable
+# Status snapshot which main() picks up whenever it draws a frame.
+
+# seconds between refreshes of each endpoint. version never changes while
+# OctoPrint is running, so it is only fetched once per connection. the job
+# can be fetched rarely, its progress is carried on by ProgressModel.
+poll_intervals = {
+    'version': None,
+    'connection': 5,
+    'printer': 1,
+    'job': config['job_interval']
+}
+
+class ApiCache(object):
+    def __init__(self, intervals, client):
+        self.intervals = intervals
+        self.client = client
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def expired(self, api_path, now):
+        entry = self.entries.get(api_path)
+        if entry is None:
+            return True
+
+        interval = self.intervals.get(api_path, 0)
+        if interval is None:
+            return False
+
+        return now - entry[0] >= interval
+
+    def get(self, api_path):
+        now = time.time()
+
+        with self.lock:
+            if not self.expired(api_path, now):
+                return self.entries[api_path][1]
+
+        data = self.client.get(api_path)
+
+        with self.lock:
+            if data is not None:
+                self.entries[api_path] = (now, data)
+            else:
+                self.entries.pop(api_path, None)
+
+        return data
+
+    def invalidate(self, *api_paths):
+        with self.lock:
+            for api_path in api_paths:
+                self.entries.pop(api_path, None)
+
+api_cache = ApiCache(poll_intervals, client)
+
+def get_info(api_path):
+    return api_cache.get(api_path)
+
+def post_info(api_path, command):
+    response = client.post(api_path, command)
+
+    # a command changes printer state, don't keep showing the old one
+    api_cache.invalidate('job', 'printer', 'connection')
+
+    return response
+
+# temperatures kept for the graph, one sample a second at most. the arrays
+# are allocated up front and overwritten in a ring, so hours of history
+# never grow memory.
+
+temp_series = ('ext', 'ext_target', 'bed', 'bed_target')
+
+class TempHistory(object):
+    def __init__(self, size, resolution=1.0):
+        self.size = size
+        self.resolution = resolution
+        self.times = array('d', [0.0]) * size
+        self.values = [array('f', [0.0]) * size for name in temp_series]
+        self.head = 0
+        self.count = 0
+        self.seeded = False
+
+        # bumped when older samples arrive, anything drawn from the history
+        # has to start over
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def add(self, t, temperature):
+        with self.lock:
+            if self.count and t - self.times[self.head - 1] < self.resolution:
+                return False
+
+            self.times[self.head] = t
+            for series, (tool, key) in zip(self.values, [('tool0', 'actual'), ('tool0', 'target'), ('bed', 'actual'), ('bed', 'target')]):
+                series[self.head] = temperature[tool][key] or 0
+
+            self.head = (self.head + 1) % self.size
+            self.count = min(self.count + 1, self.size)
+            return True
+
+    def seed(self, samples, now):
+        # stamped by OctoPrint's clock, which needn't agree with ours. the
+        # newest sample is taken to be from now.
+        skew = now - samples[-1]['time'] if samples else 0
+        for sample in samples:
+            self.add(sample['time'] + skew, sample)
+        self.seeded = True
+        self.generation += 1
+
+    def since(self, t):
+        # samples newer than t, oldest first, as (time, ext, ext_target,
+        # bed, bed_target). walks back from the newest so only the part
+        # asked for is copied.
+        samples = []
+        with self.lock:
+            index = self.head
+            for i in range(self.count):
+                index = (index - 1) % self.size
+                if self.times[index] <= t:
+                    break
+                samples.append((self.times[index],) + tuple(series[index] for series in self.values))
+
+        samples.reverse()
+        return samples
+
+# between fetches of the job, completion is carried on at the rate it
+# changed at over the last few samples and time left counts down with the
+# clock. OctoPrint revises its time left estimate as it goes, so that is not
+# extrapolated. when a fresh sample disagrees with what is shown the
+# difference is eased out over a few seconds rather than jumped.
+
+class ProgressModel(object):
+    def __init__(self, samples=4, spacing=5.0, ease=5.0, horizon=120.0):
+        self.samples = deque(maxlen=samples)
+        self.spacing = spacing
+        self.ease = ease
+        self.horizon = horizon
+        self.error = (0.0, 0.0)
+        self.corrected = 0
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.error = (0.0, 0.0)
+
+    def rate(self, samples):
+        # least squares slope of completion per second. a lone sample has
+        # the rest of the job done by the time its time left reaches zero.
+        mean_t = sum(sample[0] for sample in samples) / len(samples)
+        spread = sum((sample[0] - mean_t) ** 2 for sample in samples)
+        if spread == 0:
+            t, completion, time_left = samples[-1]
+            if time_left > 0:
+                return (100.0 - completion) / time_left
+            return 0.0
+
+        mean = sum(sample[1] for sample in samples) / len(samples)
+        return sum((sample[0] - mean_t) * (sample[1] - mean) for sample in samples) / spread
+
+    def predict(self, samples, now):
+        t, completion, time_left = samples[-1]
+
+        # a job that stopped answering isn't guessed at forever
+        elapsed = min(max(now - t, 0), self.horizon)
+        return min(100.0, max(0.0, completion + self.rate(samples) * elapsed)), max(0.0, time_left - elapsed)
+
+    def add(self, now, completion, time_left):
+        if completion is None or time_left is None:
+            self.reset()
+            return
+
+        sample = (now, float(completion), float(time_left))
+        with self.lock:
+            # a job that started over is a new job
+            if self.samples and completion < self.samples[-1][1]:
+                self.samples.clear()
+
+            shown = None
+            if self.samples:
+                shown = self.estimate_locked(now)
+
+            # samples closer than spacing only move the newest one, pushed
+            # updates would otherwise make the slope all noise
+            if len(self.samples) >= 2 and now - self.samples[-2][0] < self.spacing:
+                self.samples[-1] = sample
+            else:
+                self.samples.append(sample)
+
+            self.error = (0.0, 0.0)
+            if shown is not None:
+                self.error = (shown[0] - sample[1], shown[1] - sample[2])
+                self.corrected = now
+
+    def estimate_locked(self, now):
+        completion, time_left = self.predict(list(self.samples), now)
+        weight = max(0.0, 1 - (now - self.corrected) / self.ease)
+        return min(100.0, max(0.0, completion + self.error[0] * weight)), max(0.0, time_left + self.error[1] * weight)
+
+    def estimate(self, now):
+        # (completion, time left) as they should be shown now, None without
+        # a printing job
+        with self.lock:
+            if not self.samples:
+                return None
+            return self.estimate_locked(now)
+
+Status = namedtuple('Status', [
+    'state', 'completion', 'file_name', 'file_size', 'time_left',
+    'file_path', 'file_origin', 'file_date', 'file_pos',
+    'api_version', 'octo_version', 'ext', 'ext_target', 'bed', 'bed_target',
+    'updated', 'health'
+])
+
+def build_status(job, ver, stateinfo, printer, updated, health=ONLINE):
+    if job is not None:
+        file_name = job['job']['file']['name']
+        file_size = job['job']['file']['size']
+        completion = job['progress']['completion']
+        if completion is not None: completion = int(round(completion))
+        time_left = job['progress']['printTimeLeft']
+        file_path = job['job']['file'].get('path')
+        file_origin = job['job']['file'].get('origin')
+        file_date = job['job']['file'].get('date')
+        file_pos = job['progress'].get('filepos')
+    else:
+        file_name = "_.gcode"
+        file_size = 0
+        completion = "0"
+        time_left = "0"
+        file_path = None
+        file_origin = None
+        file_date = None
+        file_pos = None
+
+    if ver is not None:
+        api_version = ver['api']
+        octo_version = ver['server']
+    else:
+        api_version = "0"
+        octo_version = "0"
+
+    if stateinfo is not None and health != OFFLINE:
+        state = stateinfo['current']['state']
+    else:
+        state = "Offline"
+        completion = 0
+
+    ext = 0
+    ext_target = 0
+    bed = 0
+    bed_target = 0
+
+    if state != "Offline" and printer is not None:
+        ext = int(printer['temperature']['tool0']['actual'])
+        ext_target = int(printer['temperature']['tool0']['target'])
+        bed = int(printer['temperature']['bed']['actual'])
+        bed_target = int(printer['temperature']['bed']['target'])
+
+    return Status(state, completion, file_name, file_size, time_left,
+                  file_path, file_origin, file_date, file_pos,
+                  api_version, octo_version, ext, ext_target, bed, bed_target,
+                  updated, health)
+
+class StatusPoller(threading.Thread):
+    def __init__(self, interval, history=None, client=client, cache=api_cache):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.history = history
+        self.client = client
+        self.cache = cache
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+        # optional PushListener, polling only fills in while it is down
+        self.push = None
+        self.pushed = {}
+        self.version = None
+
+        # nothing has been fetched yet, so start out offline
+        self.snapshot = build_status(None, None, None, None, 0, OFFLINE)
+
+        # fed with every job answer, once
+        self.progress = ProgressModel()
+        self.sampled = None
+
+        # the last error polling ran into
+        self.error = None
+
+        # called from the poller's threads whenever the snapshot changes
+        self.on_change = None
+
+    def publish(self, snapshot):
+        previous = self.snapshot
+
+        # replacing the reference is atomic, readers never see a half
+        # built snapshot
+        self.snapshot = snapshot
+
+        if self.on_change is not None and snapshot._replace(updated=0) != previous._replace(updated=0):
+            self.on_change()
+
+    def track_progress(self, job):
+        # cached answers come back as the same object, a new one is a fetch
+        if job is self.sampled:
+            return
+        self.sampled = job
+
+        if job is None or not job['state'].startswith("Printing"):
+            self.progress.reset()
+            return
+
+        self.progress.add(self.client.now(), job['progress']['completion'], job['progress']['printTimeLeft'])
+
+    def estimated(self, now):
+        # the snapshot with its progress carried on to now
+        snapshot = self.snapshot
+        if not snapshot.state.startswith("Printing"):
+            return snapshot
+
+        estimate = self.progress.estimate(now)
+        if estimate is None:
+            return snapshot
+
+        return snapshot._replace(completion=int(round(estimate[0])), time_left=int(round(estimate[1])))
+
+    def apply_push(self, message):
+        current = message.get('current', message.get('history'))
+        if current is None:
+            return
+
+        # reshape the pushed state into the responses get_info would return
+        state = current['state']['text']
+
+        with self.lock:
+            self.pushed['job'] = {'state': state, 'job': current['job'], 'progress': current['progress']}
+            self.pushed['connection'] = {'current': {'state': state}}
+
+            if current.get('temps'):
+                temperature = dict(current['temps'][-1])
+                temperature.pop('time', None)
+                self.pushed['printer'] = {'temperature': temperature}
+
+            pushed = dict(self.pushed)
+
+        # a history message carries the last few minutes of temperatures
+        if self.history is not None:
+            temps = current.get('temps', [])
+            if 'history' in message:
+                self.history.seed(temps, self.client.now())
+            elif temps:
+                # on our clock, as seed() does
+                skew = self.client.now() - temps[-1]['time']
+                for sample in temps:
+                    self.history.add(sample['time'] + skew, sample)
+
+        self.track_progress(pushed['job'])
+        self.publish(build_status(pushed['job'], self.version, pushed['connection'], pushed.get('printer'), self.client.now(), self.client.health.state))
+
+    def poll(self):
+        ver = self.cache.get('version')
+        self.version = ver
+
+        if self.push is not None and self.push.live() and 'job' in self.pushed:
+            with self.lock:
+                job = self.pushed.get('job')
+                stateinfo = self.pushed.get('connection')
+                printer = self.pushed.get('printer')
+        else:
+            job = self.cache.get('job')
+            stateinfo = self.cache.get('connection')
+            printer = None
+
+        if stateinfo is not None and stateinfo['current']['state'] != "Offline":
+            if self.history is not None and not self.history.seeded:
+                self.seed_history()
+
+            if printer is None:
+                printer = self.cache.get('printer')
+                if printer is not None and self.history is not None:
+                    self.history.add(self.client.now(), printer['temperature'])
+        else:
+            # the next connection may be to an upgraded server
+            self.cache.invalidate('version')
+
+        # a round that reached the server counts as fresh data
+        updated = self.snapshot.updated
+        if stateinfo is not None:
+            updated = self.client.now()
+
+        self.track_progress(job)
+        return build_status(job, ver, stateinfo, printer, updated, self.client.health.state)
+
+    def seed_history(self):
+        # OctoPrint keeps a few minutes of temperatures, start the graph
+        # from those instead of an empty one
+        printer = self.client.get('printer?history=true&limit=%d' % self.history.size)
+        if printer is not None:
+            self.history.seed(printer['temperature'].get('history', []), self.client.now())
+
+    def probe(self):
+        if not self.client.health.should_probe():
+            return
+
+        # version is the cheapest endpoint, any answer brings us back online
+        if self.client.get('version') is not None:
+            self.cache.invalidate('version', 'connection', 'printer', 'job')
+            self.publish(self.poll())
+        else:
+            self.publish(build_status(None, None, None, None, self.snapshot.updated, OFFLINE))
+
+    def run(self):
+        while not self.stopped.is_set():
+            started = time.time()
+
+            try:
+                if self.client.health.state == OFFLINE:
+                    self.probe()
+                else:
+                    self.publish(self.poll())
+
+                profiler.record('fetch', time.time() - started)
+                self.error = None
+            except Exception as e:
+                # keep serving the last good snapshot, its age shows on
+                # screen. an error that repeats every round is logged once.
+                if repr(e) != self.error:
+                    log.exception("polling %s failed", self.client.url)
+                    self.error = repr(e)
+
+            remaining = self.interval - (time.time() - started)
+            if remaining > 0:
+                self.stopped.wait(remaining)
+
+    def stop(self):
+        if self.push is not None:
+            self.push.stop()
+
+        self.stopped.set()
+        self.join(1)
+########## end status poller classes ##########
+
+########## start push listener classes ##########
+#
+# OctoPrint pushes state changes over SockJS at /sockjs. the xhr-streaming
+# transport is plain HTTP, so it runs on requests with no extra dependency.
+# any message, including heartbeats, proves the socket is alive.
+
+# SockJS heartbeats every 25 seconds
+push_timeout = 35
+
+class PushListener(threading.Thread):
+    def __init__(self, client, poller, retry):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.client = client
+        self.poller = poller
+        self.retry = retry
+        self.connected = False
+        self.last_frame = 0
+        self.response = None
+        self.session = None
+        self.stopped = threading.Event()
+
+    def live(self):
+        return self.connected and time.time() - self.last_frame < push_timeout
+
+    def session_url(self):
+        server = "%03d" % random.randint(0, 999)
+        session = ''.join(random.choice('abcdefghijklmnopqrstuvwxyz0123456789') for i in range(8))
+        return "%s/sockjs/%s/%s/" % (self.client.url, server, session)
+
+    def send(self, url, message):
+        self.session.post(url + 'xhr_send', data = json.dumps([json.dumps(message)]), timeout = self.client.timeout)
+
+    def authenticate(self, url):
+        # OctoPrint only pushes printer state to authenticated sockets
+        login = self.client.post('login', {'passive': True})
+        if login is not None:
+            self.send(url, {'auth': "%s:%s" % (login['name'], login['session'])})
+
+    def listen(self):
+        url = self.session_url()
+        self.response = self.session.post(url + 'xhr_streaming', stream = True, timeout = (self.client.timeout[0], push_timeout))
+
+        if self.response.status_code != 200:
+            return
+
+        for frame in self.response.iter_lines(chunk_size = None):
+            if self.stopped.is_set():
+                break
+
+            self.last_frame = time.time()
+
+            # the prelude and heartbeats are runs of 'h'
+            if not frame or frame[0] == 'h':
+                continue
+
+            if frame == 'o':
+                self.connected = True
+                log.info("push connected to %s", self.client.url)
+                self.authenticate(url)
+            elif frame[0] == 'a':
+                for message in json.loads(frame[1:]):
+                    message = json.loads(message)
+                    if recorder is not None:
+                        recorder.write(self.client.url, 'PUSH', None, None, message)
+                    self.poller.apply_push(message)
+            elif frame[0] == 'c':
+                break
+
+    def run(self):
+        # the stream holds its connection open, keep it out of the client's pool
+        self.session = load_requests().Session()
+        self.session.headers.update(self.client.connect().headers)
+
+        while not self.stopped.is_set():
+            try:
+                self.listen()
+            except Exception as e:
+                # stop() closes the stream under listen(), that is no error.
+                # anything else is logged and the socket is opened again.
+                if self.stopped.is_set():
+                    break
+                if isinstance(e, (requests.exceptions.RequestException, ValueError)):
+                    log.info("push connection lost: %s", e)
+                else:
+                    log.exception("push listener for %s failed", self.client.url)
+
+            # polling takes over until the socket is back
+            self.connected = False
+            with self.poller.lock:
+                self.poller.pushed = {}
+
+            self.stopped.wait(self.retry)
+
+    def stop(self):
+        self.stopped.set()
+
+        if self.response is not None:
+            self.response.close()
+########## end push listener classes ##########
+
+########## start printer classes ##########
+#
+# several OctoPrint hosts can be shown from one display. every printer has
+# its own client, cache, history and poller thread, so printers are polled
+# concurrently and an unreachable host only ever delays itself. an entry in
+# printers may name its own apikey and webcam_url.
+
+class Printer(object):
+    def __init__(self, name, client, cache, poll_interval, push_retry=None, webcam_url=None):
+        self.name = name
+        self.client = client
+        self.history = TempHistory(config['temp_history'])
+        self.poller = StatusPoller(poll_interval, self.history, client, cache)
+        if push_retry is not None:
+            self.poller.push = PushListener(client, self.poller, push_retry)
+
+        # created by the first detail screen that shows this printer
+        self.graph = None
+        self.preview = None
+
+        # made when the file browser or the camera is first opened for
+        # this printer
+        self.files = None
+        self.webcam = None
+        self.webcam_url = webcam_url or client.url + '/webcam/?action=snapshot'
+
+    def start(self):
+        if self.poller.push is not None:
+            self.poller.push.start()
+        self.poller.start()
+
+    def command(self, command, api_path='job'):
+        # the display doesn't wait for the answer
+        def send():
+            self.client.post(api_path, command)
+
+            # a command changes printer state, don't keep showing the old one
+            self.poller.cache.invalidate('job', 'printer', 'connection')
+
+        worker = threading.Thread(target=send)
+        worker.daemon = True
+        worker.start()
+
+    def stop(self):
+        if self.preview is not None:
+            self.preview.stop()
+        if self.webcam is not None:
+            self.webcam.stop()
+        self.poller.stop()
+
+def create_printers(poll_interval):
+    push_retry = None
+    if config['push']:
+        push_retry = config['push_retry']
+
+    # a recording stands in for the servers
+    if config['replay']:
+        printers = []
+        for entry in config['printers'] or [{'name': config['name'], 'url': config['url']}]:
+            replay = ReplayClient(config['replay'], config['replay_speed'], entry['url'].rstrip('/'))
+            printer = Printer(entry.get('name', entry['url']), replay, ApiCache(poll_intervals, replay), poll_interval, webcam_url=entry.get('webcam_url', config['webcam_url']))
+            printer.poller.push = replay
+            replay.on_push = printer.poller.apply_push
+            printers.append(printer)
+        return printers
+
+    # without a printers list it is just the one from url and apikey
+    if not config['printers']:
+        return [Printer(config['name'], client, api_cache, poll_interval, push_retry, config['webcam_url'])]
+
+    printers = []
+    for entry in config['printers']:
+        octo = OctoClient(entry['url'], entry.get('apikey', dat_key), config['connect_timeout'], config['read_timeout'], config['keep_alive'])
+        printers.append(Printer(entry.get('name', entry['url']), octo, ApiCache(poll_intervals, octo), poll_interval, push_retry, entry.get('webcam_url', config['webcam_url'])))
+
+    return printers
+
+def overview_lines(printers, page, rows, stale_after):
+    # two rows per printer, a page footer when they don't fit on one screen
+    lines = []
+    y = 5
+    now = time.time()
+
+    for printer in printers[page * rows:(page + 1) * rows]:
+        status = printer.poller.estimated(now)
+
+        name = printer.name[:16]
+        if status.updated == 0 or now - status.updated > stale_after:
+            name += "*"
+
+        # OctoPrint sends no completion or time left without a job, the
+        # columns stay blank so the temperatures line up
+        progress = " " * 11
+        if status.completion is not None:
+            try:
+                left = int(status.time_left)
+            except (TypeError, ValueError):
+                left = 0
+            progress = "%3s%%  %02d:%02d" % (status.completion, left // 3600, left % 3600 // 60)
+
+        detail = ""
+        if status.state != 'Offline':
+            detail = "  %s  E%3d B%3d" % (progress, status.ext, status.bed)
+
+        lines.append((5, y, name.ljust(18) + status.state[:16]))
+        lines.append((5, y + 25, detail))
+        y += 50
+
+    while y < 5 + rows * 50:
+        lines.append((5, y, ""))
+        lines.append((5, y + 25, ""))
+        y += 50
+
+    pages = (len(printers) + rows - 1) // rows
+    if pages > 1:
+        lines.append((5, 455, "Page %d/%d" % (page + 1, pages)))
+
+    return lines
+
+def status_lines(status, name, interfaces, max_interfaces, now, stale_after):
+    # the detail screen for one printer, as (x, y, text) lines
+    ds = u'\N{DEGREE SIGN}'
+
+    state = status.state
+    file_name = status.file_name
+    file_size = status.file_size
+    progress_completion = status.completion
+    progress_printtimeleft = status.time_left
+    api_version = status.api_version
+    octo_version = status.octo_version
+    ext = status.ext
+    ext_target = status.ext_target
+    bed = status.bed
+    bed_target = status.bed_target
+
+    ext_f = CtoF(ext).ljust(3)
+    bed_f = CtoF(bed).ljust(3)
+				
+    if ext_target == 0 or bed_target == 0:
+        ext_target_f = "0".rjust(3)
+        bed_target_f = "0".rjust(3)
+    else:
+        ext_target_f = CtoF(ext_target).ljust(3)
+        bed_target_f = CtoF(bed_target).ljust(3)
+		           
+    if ext_target_f == "32": ext_target_f = 0
+    if bed_target_f == "32": bed_target_f = 0;
+    if progress_printtimeleft is not None:
+        seconds = float(int(progress_printtimeleft))
+        day = seconds // (24 * 3600)
+        seconds = seconds % (24 * 3600)
+        hour = seconds // 3600
+        seconds %= 3600
+        minutes = seconds // 60
+        seconds %= 60
+    else:
+        seconds = 0
+        day = 0
+        hour = 0
+        minutes = 0
+            
+    # render each string
+    status_text = ""
+    if progress_completion is not None and state != 'Offline':
+        status_text = "Status: " + state + " (" + `progress_completion` + "%)"
+    else:
+        status_text = "Status: " + state
+
+    filename_text = ""
+    if file_name is not None and state != 'Offline':
+        filename_text = "Name:   " + file_name.replace("_", " ").replace(".gcode", "")
+    else:
+        filename_text = "Name: "
+
+    if file_size is not None and state != 'Offline':
+        size_text = "Size:   " + "{:,}".format(file_size) + " Bytes"
+    else:
+        size_text = "Size:"
+    
+    ext_c = `ext`
+    ext_target_c = `ext_target`
+    bed_c = `bed`
+    bed_target_c = `bed_target`
+    
+    if state == 'Offline':
+        ext_f = "0"
+        bed_f = "0"
+    
+    bed_space = ""
+    if len(bed_f) == 2:
+        bed_space = " "
+    
+    lines = [
+        (5, 5, status_text),
+        (5, 30, filename_text),
+        (5, 55, size_text),
+        (5, 80, "ETA:    %02d:%02d:%02d" % (day, hour, minutes))
+    ]
+
+    # flag stale data when the server is slow or unreachable
+    stale_text = ""
+    if status.updated == 0:
+        stale_text = "Updated: never"
+    elif now - status.updated > stale_after:
+        stale_text = "Updated: %ds ago" % (now - status.updated)
+
+    # with several printers this is also the way back
+    if name is not None:
+        stale_text = ("< " + name[:16] + "  " + stale_text).rstrip()
+
+    lines.append((5, 105, stale_text))
+
+    # two rows per interface, blank rows clear interfaces that went away
+    y = 130
+    for interface, ip, mac in interfaces[:max_interfaces]:
+        lines.append((5, y, (interface + ":").ljust(8) + ip.ljust(15)))
+        lines.append((5, y + 25, "        " + mac.ljust(17)))
+        y += 50
+
+    while y < 130 + max_interfaces * 50:
+        lines.append((5, y, ""))
+        lines.append((5, y + 25, ""))
+        y += 50
+
+    if state != 'Offline':
+        lines.append((5, 335, "Ext: %3d/%3d%sC  Bed: %3d/%3d%sC" % (ext, ext_target, ds, bed, bed_target, ds)))
+    else:
+        lines.append((5, 335, ""))
+
+    #if state != 'Offline':
+        #printText(font, WHITE, "Ver: " + api_version + "-" + octo_version, background, 330,5)
+        #printText(font, WHITE, "  [ extruder: " + ext_f.rjust(3) + ds + "F / " + ext_c.rjust(3) + ds + "C  " + bed_space + "  bed:    " + bed_space + "    " + bed_f.rjust(3).replace(' ', '') + ds + "F / " + bed_c.rjust(3).replace(' ', '') + ds + "C ]", background, 5, 110)
+        #printText(font, WHITE, "  [ target:   " + ext_target_f.rjust(3) + ds + "F / " + ext_target_c.rjust(3) + ds + "C  " + bed_space + "  target:     " + bed_target_f.rjust(3).replace(' ', '') + ds + "F /" + bed_target_c.rjust(3) + ds + "C ]", background, 5, 128)
+        #printText(font, WHITE, "%02d:%02d:%02d" % (day, hour, minutes), background, 205, 300)
+
+    #printText(font, WHITE, tzdata.strftime('%m-%d-%Y'), background, 5,300)
+    #printText(font, WHITE, tzdata.strftime('%H:%M:%S'), background, 405,300)
+    
+    #setProgress(background, progress_completion)
+
+    return lines
+
+def overview_widgets(count, page, rows):
+    widgets = []
+    for row in range(min(rows, count - page * rows)):
+        widgets.append(Button('printer', (0, 5 + row * 50, 320, 50), value=page * rows + row))
+
+    if count > rows:
+        widgets.append(Button('page', (0, 450, 320, 30)))
+
+    return widgets
+########## end printer classes ##########
+
+########## start status server classes ##########
+#
+# with "status_port" set the snapshots the display already has are served
+# to other scripts and dashboards, so one poller serves them all instead of
+# each polling OctoPrint itself. /status is JSON with a weak ETag that
+# changes with the data; a request carrying it and ?wait=N is held until
+# something changes or N seconds pass. /metrics is the same in Prometheus'
+# text format, with the display's own timings.
+
+def status_number(value):
+    # build_status leaves the string "0" where there is no job, clients
+    # get a number or null
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def status_json(printer):
+    # with the progress the screen shows, not that of the last job fetch
+    status = printer.poller.estimated(printer.client.now())
+    return {
+        'name': printer.name,
+        'url': printer.client.url,
+        'state': status.state,
+        'health': status.health,
+        'updated': status.updated,
+        'file': status.file_path,
+        'size': status.file_size,
+        'completion': status_number(status.completion),
+        'time_left': status_number(status.time_left),
+        'ext': status.ext,
+        'ext_target': status.ext_target,
+        'bed': status.bed,
+        'bed_target': status.bed_target
+    }
+
+def metric_labels(**labels):
+    return '{' + ','.join('%s="%s"' % (name, unicode(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in sorted(labels.items())) + '}'
+
+def status_metrics(printers):
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for labels, value in samples:
+            if value is not None:
+                lines.append("%s%s %s" % (name, metric_labels(**labels), repr(float(value))))
+
+    statuses = [(printer.name, printer.poller.estimated(printer.client.now())) for printer in printers]
+    metric('octoprint_up', 'gauge', "Whether the server answers.",
+           [({'printer': name}, status.health != OFFLINE) for name, status in statuses])
+    metric('octoprint_printing', 'gauge', "Whether a job is printing.",
+           [({'printer': name}, status.state.startswith("Printing")) for name, status in statuses])
+    metric('octoprint_temperature_celsius', 'gauge', "Tool and bed temperatures.",
+           [({'printer': name, 'sensor': sensor, 'kind': kind}, value) for name, status in statuses if status.state != 'Offline'
+            for sensor, kind, value in [('tool0', 'actual', status.ext), ('tool0', 'target', status.ext_target), ('bed', 'actual', status.bed), ('bed', 'target', status.bed_target)]])
+    metric('octoprint_progress_percent', 'gauge', "Completion of the current job.",
+           [({'printer': name}, status_number(status.completion)) for name, status in statuses])
+    metric('octoprint_time_left_seconds', 'gauge', "Estimated time left of the current job.",
+           [({'printer': name}, status_number(status.time_left)) for name, status in statuses])
+    metric('octoprint_updated_timestamp_seconds', 'gauge', "When the data was last fetched.",
+           [({'printer': name}, status.updated) for name, status in statuses])
+
+    requests_seen = []
+    for printer in printers:
+        for endpoint, timing in sorted(printer.client.stats().items()):
+            requests_seen.append(({'printer': printer.name, 'endpoint': endpoint}, timing))
+    metric('octopicontrol_request_seconds_total', 'counter', "Time spent on requests to the server.",
+           [(labels, timing['total']) for labels, timing in requests_seen])
+    metric('octopicontrol_requests_total', 'counter', "Requests made to the server.",
+           [(labels, timing['count']) for labels, timing in requests_seen])
+    metric('octopicontrol_request_errors_total', 'counter', "Requests that failed.",
+           [(labels, timing['errors']) for labels, timing in requests_seen])
+
+    # only there with "profile" set
+    phases = sorted(profiler.summary().items())
+    metric('octopicontrol_phase_seconds', 'summary', "Time spent per frame phase.",
+           [({'phase': phase, 'quantile': quantile}, summary[key] / 1000.0) for phase, summary in phases
+            for quantile, key in [('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')]])
+
+    return '\n'.join(lines) + '\n'
+
+class StatusHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        log.debug("status server: " + format, *args)
+
+    def send_body(self, body, content_type, etag=None):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path, query = (self.path.split('?', 1) + [''])[:2]
+        query = urlparse.parse_qs(query)
+        server = self.server
+
+        if path == '/status':
+            etag = server.wait(self.headers.getheader('If-None-Match'), query.get('wait', ['0'])[0])
+            if etag == self.headers.getheader('If-None-Match'):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                body = json.dumps({'printers': [status_json(printer) for printer in server.printers]})
+                self.send_body(body, 'application/json', etag)
+        elif path == '/metrics':
+            self.send_body(status_metrics(server.printers).encode('utf-8'), 'text/plain; version=0.0.4')
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+class StatusServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    max_wait = 60
+
+    def __init__(self, printers, bind, port):
+        HTTPServer.__init__(self, (bind, port), StatusHandler)
+        self.printers = printers
+        self.generation = 0
+        self.condition = threading.Condition()
+        self.thread = None
+
+        # passed on to, e.g. the scheduler
+        self.on_change = None
+
+    def etag(self):
+        # weak, the age of the data changes without a new generation
+        return 'W/"%d"' % self.generation
+
+    def changed(self):
+        # the pollers call this instead of the scheduler
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
+
+        if self.on_change is not None:
+            self.on_change()
+
+    def wait(self, etag, wait):
+        # holds a request whose data is current until it isn't
+        try:
+            wait = min(float(wait), self.max_wait)
+        except ValueError:
+            wait = 0
+
+        deadline = time.time() + wait
+        with self.condition:
+            while etag == self.etag() and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+            return self.etag()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        log.info("serving status on %s:%d", *self.server_address)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+        # let long polls return now rather than when they time out
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
+########## end status server classes ##########
+
+def CtoF(value):
+    return `int(round(9 / 5 * value + 32))`
+
+def rptstr(str, cnt):
+    return ''.join([char * cnt for char in str])
+
+def setProgress(surface, percent):
+    WHITE = (255,255,255)
+    pygame.draw.rect(surface, WHITE, (5, 65, 470, 40), 2)
+    
+    if percent >= 7:
+        pygame.draw.rect(surface, WHITE, (14, 70, 30, 30))
+    if percent >= 16:
+	pygame.draw.rect(surface, WHITE, (49, 70, 30, 30))
+    if percent >= 24:
+	pygame.draw.rect(surface, WHITE, (84, 70, 30, 30))
+    if percent >= 31:
+	pygame.draw.rect(surface, WHITE, (119, 70, 30, 30))
+    if percent >= 39:
+	pygame.draw.rect(surface, WHITE, (154, 70, 30, 30))
+    if percent >= 45:
+	pygame.draw.rect(surface, WHITE, (189, 70, 30, 30))
+    if percent >= 52:
+        pygame.draw.rect(surface, WHITE, (224, 70, 30, 30))
+    if percent >= 60:
+        pygame.draw.rect(surface, WHITE, (260, 70, 30, 30))
+    if percent >= 69:
+	pygame.draw.rect(surface, WHITE, (295, 70, 30, 30))
+    if percent >= 78:
+	pygame.draw.rect(surface, WHITE, (330, 70, 30, 30))
+    if percent >= 85:
+	pygame.draw.rect(surface, WHITE, (365, 70, 30, 30))
+    if percent >= 92:
+	pygame.draw.rect(surface, WHITE, (401, 70, 30, 30))
+    if percent >= 100:
+	pygame.draw.rect(surface, WHITE, (437, 70, 30, 30))
+
+def show_cached_frame(screen, path):
+    # the last frame of the previous run, shown while the first status loads
+    if not path or not os.path.exists(path):
+        return False
+
+    try:
+        screen.blit(pygame.image.load(path), (0, 0))
+    except pygame.error as e:
+        log.info("can't show %s: %s", path, e)
+        return False
+
+    display.flip()
+    return True
+
+def save_frame(screen, path):
+    if not path:
+        return
+
+    # bmp needs no compression, this runs between frames
+    try:
+        pygame.image.save(screen, path)
+    except pygame.error as e:
+        log.info("can't save %s: %s", path, e)
+
+def createSurface(screen, bgcolor):
+    bground = pygame.Surface(screen.get_size())
+    bground = bground.convert(screen)
+    bground.fill(bgcolor)
+		
+    return bground
+
+def backLight(state, path=None):
+    file = open(path or config['backlight'],"w") 
+    file.write(state)
+    file.close()
+    return
+
+def printText(font, color, text, background, x, y):
+    item = text_cache.render(font, text, True, color)
+    return background.blit(item, (x, y))
+
+########## start temperature graph classes ##########
+#
+# the graph is kept on its own surface. when time moves on by a column the
+# surface is scrolled left and only the new columns are drawn, the rest of
+# the history is never redrawn.
+
+class TempGraph(object):
+    colors = [(255, 96, 0), (96, 48, 0), (0, 128, 255), (0, 48, 96)]
+    grid = (40, 40, 40)
+
+    def __init__(self, width, height, history, span, max_temp=300):
+        self.width = width
+        self.height = height
+        self.history = history
+        self.per_column = float(span) / width
+        self.max_temp = max_temp
+        self.surface = pygame.Surface((width, height)).convert()
+        self.surface.fill((0, 0, 0))
+        self.column = None
+        self.generation = None
+        self.last = {}
+
+    def y(self, temp):
+        return self.height - 1 - int(min(temp, self.max_temp) * (self.height - 1) / self.max_temp)
+
+    def next_column(self, now):
+        # seconds until update() has something new to draw
+        return (int(now / self.per_column) + 1) * self.per_column - now
+
+    def update(self, now):
+        column = int(now / self.per_column)
+        if column == self.column and self.generation == self.history.generation:
+            return False
+
+        # only finished columns are drawn, after a long sleep or once the
+        # history was seeded everything is
+        if self.column is None or column - self.column >= self.width or self.generation != self.history.generation:
+            shift = self.width
+            self.last = {}
+        else:
+            shift = column - self.column
+
+        self.surface.scroll(-shift, 0)
+        self.surface.fill((0, 0, 0), (self.width - shift, 0, shift, self.height))
+        for temp in range(100, self.max_temp, 100):
+            y = self.y(temp)
+            pygame.draw.line(self.surface, self.grid, (self.width - shift, y), (self.width - 1, y))
+
+        # newest sample in each of the new columns
+        newest = {}
+        for sample in self.history.since((column - shift) * self.per_column):
+            sample_column = int(sample[0] / self.per_column)
+            if sample_column < column:
+                newest[sample_column] = sample[1:]
+
+        for new_column in range(column - shift, column):
+            x = self.width - (column - new_column)
+            sample = newest.get(new_column)
+
+            # leave a gap where nothing was recorded
+            if sample is None:
+                self.last = {}
+                continue
+
+            for series, (temp, color) in enumerate(zip(sample, self.colors)):
+                y = self.y(temp)
+                pygame.draw.line(self.surface, color, (x - 1, self.last.get(series, y)), (x, y))
+                self.last[series] = y
+
+        self.column = column
+        self.generation = self.history.generation
+        return True
+########## end temperature graph classes ##########
+
+########## start gcode preview classes ##########
+#
+# with "preview" set the file being printed is downloaded and parsed as it
+# streams in, on a thread of its own. extruding moves are drawn top down
+# into two small maps holding the lowest and highest layer that touched
+# each pixel, so memory doesn't grow with the file. the maps and the file
+# offset of every layer are kept in preview_cache, so a reprint or a
+# restart shows the preview without downloading the file again.
+
+def gcode_lines(chunks):
+    # (offset, line) for every line of a file arriving in chunks, offsets
+    # are what OctoPrint reports as the job's filepos
+    offset = 0
+    rest = ''
+    for chunk in chunks:
+        lines = (rest + chunk).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            yield offset, line
+            offset += len(line) + 1
+
+    if rest:
+        yield offset, rest
+
+class LayerMap(object):
+    empty = 0xffff
+
+    def __init__(self, size, bed):
+        self.size = size
+        self.scale = (float(size - 1) / bed[0], float(size - 1) / bed[1])
+        self.low = array('H', [self.empty]) * (size * size)
+        self.high = array('H', [0]) * (size * size)
+        self.layers = []
+
+    def pixel(self, x, y):
+        column = min(max(int(x * self.scale[0]), 0), self.size - 1)
+        row = min(max(int(y * self.scale[1]), 0), self.size - 1)
+
+        # G-code has y pointing away from the front of the bed
+        return (self.size - 1 - row) * self.size + column
+
+    def line(self, x0, y0, x1, y1, layer):
+        steps = int(max(abs(x1 - x0) * self.scale[0], abs(y1 - y0) * self.scale[1])) + 1
+        for step in range(steps + 1):
+            index = self.pixel(x0 + (x1 - x0) * step / steps, y0 + (y1 - y0) * step / steps)
+            if layer < self.low[index]:
+                self.low[index] = layer
+            if layer > self.high[index]:
+                self.high[index] = layer
+
+    def parse(self, lines, stopped):
+        x = y = z = e = 0.0
+        absolute = True
+        absolute_e = True
+        layer_z = None
+
+        for offset, line in lines:
+            if stopped.is_set():
+                return False
+
+            words = line.split(';', 1)[0].split()
+            if not words:
+                continue
+
+            command = words[0].upper()
+            values = {}
+            for word in words[1:]:
+                try:
+                    values[word[0].upper()] = float(word[1:])
+                except ValueError:
+                    pass
+
+            if command in ('G0', 'G1'):
+                if absolute:
+                    new_x, new_y, new_z = values.get('X', x), values.get('Y', y), values.get('Z', z)
+                else:
+                    new_x, new_y, new_z = x + values.get('X', 0), y + values.get('Y', 0), z + values.get('Z', 0)
+
+                extruding = False
+                if 'E' in values:
+                    extruding = values['E'] > e if absolute_e else values['E'] > 0
+                    e = values['E'] if absolute_e else e + values['E']
+
+                # a layer starts with the first extrusion at a new height
+                if extruding and (new_x, new_y) != (x, y):
+                    if new_z != layer_z and len(self.layers) < self.empty:
+                        layer_z = new_z
+                        self.layers.append(offset)
+                    self.line(x, y, new_x, new_y, len(self.layers) - 1)
+
+                x, y, z = new_x, new_y, new_z
+            elif command == 'G90':
+                absolute = True
+                absolute_e = True
+            elif command == 'G91':
+                absolute = False
+                absolute_e = False
+            elif command == 'M82':
+                absolute_e = True
+            elif command == 'M83':
+                absolute_e = False
+            elif command == 'G92':
+                x = values.get('X', x)
+                y = values.get('Y', y)
+                z = values.get('Z', z)
+                e = values.get('E', e)
+
+        return True
+
+    def layer(self, file_pos):
+        # the layer being printed at a file offset
+        return max(bisect.bisect_right(self.layers, file_pos) - 1, 0)
+
+    def save(self, path):
+        data = {
+            'size': self.size,
+            'layers': self.layers,
+            'low': base64.b64encode(self.low.tostring()),
+            'high': base64.b64encode(self.high.tostring())
+        }
+
+        # written aside and renamed, a half written preview is never loaded
+        with gzip.open(path + '.tmp', 'wb') as preview_file:
+            preview_file.write(json.dumps(data))
+        os.rename(path + '.tmp', path)
+
+    def load(self, path):
+        with gzip.open(path, 'rb') as preview_file:
+            data = json.loads(preview_file.read())
+
+        if data['size'] != self.size:
+            return False
+
+        self.layers = data['layers']
+        self.low = array('H', base64.b64decode(data['low']))
+        self.high = array('H', base64.b64decode(data['high']))
+        return True
+
+class GcodePreview(object):
+    done = (150, 150, 150)
+    current = (255, 96, 0)
+    pending = (50, 50, 50)
+
+    def __init__(self, client, size, bed, cache_dir):
+        self.client = client
+        self.size = size
+        self.bed = bed
+        self.cache_dir = cache_dir
+        self.key = None
+        self.map = None
+        self.stopped = threading.Event()
+        self.surface = pygame.Surface((size, size)).convert()
+        self.surface.fill((0, 0, 0))
+        self.shown = None
+
+        # called from the loading thread once there is something to show
+        self.on_change = None
+
+    def cache_path(self, origin, path, date):
+        # a file uploaded again under the same name has another date
+        key = hashlib.sha1(json.dumps([origin, path, date, self.size, self.bed])).hexdigest()
+        return os.path.join(self.cache_dir, key + '.json.gz')
+
+    def load(self, origin, path, date, stopped):
+        layer_map = LayerMap(self.size, self.bed)
+        cache_path = self.cache_path(origin, path, date)
+
+        try:
+            if os.path.exists(cache_path) and layer_map.load(cache_path):
+                log.info("preview of %s from %s", path, cache_path)
+                self.ready(layer_map, stopped)
+                return
+        except (IOError, ValueError) as e:
+            log.warning("can't read preview %s: %s", cache_path, e)
+
+        response = self.client.download(origin, path)
+        if response is None:
+            return
+
+        started = time.time()
+        try:
+            finished = layer_map.parse(gcode_lines(response.iter_content(65536)), stopped)
+        except Exception as e:
+            log.warning("can't preview %s: %s", path, e)
+            return
+        finally:
+            response.close()
+
+        if not finished:
+            return
+
+        log.info("parsed %s into %d layers in %.1fs", path, len(layer_map.layers), time.time() - started)
+        self.ready(layer_map, stopped)
+
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            layer_map.save(cache_path)
+        except (IOError, OSError) as e:
+            log.warning("can't save preview %s: %s", cache_path, e)
+
+    def ready(self, layer_map, stopped):
+        # unless the job changed while loading
+        if not stopped.is_set():
+            self.map = layer_map
+            if self.on_change is not None:
+                self.on_change()
+
+    def show(self, status):
+        # called for every frame, starts on a new file and returns whether
+        # the surface changed
+        key = None
+        if status.state != 'Offline' and status.file_path:
+            key = (status.file_origin, status.file_path, status.file_date)
+
+        if key != self.key:
+            # a parser still busy with the old file gives up
+            self.stopped.set()
+            self.stopped = threading.Event()
+            self.key = key
+            self.map = None
+            self.shown = None
+            self.surface.fill((0, 0, 0))
+
+            if key is not None:
+                worker = threading.Thread(target=self.load, args=key + (self.stopped,))
+                worker.daemon = True
+                worker.start()
+            return True
+
+        layer_map = self.map
+        if layer_map is None:
+            return False
+
+        layer = layer_map.layer(status.file_pos or 0)
+        if (layer_map, layer) == self.shown:
+            return False
+
+        self.draw(layer_map, layer)
+        self.shown = (layer_map, layer)
+        return True
+
+    def draw(self, layer_map, layer):
+        # done where a pixel's highest layer is printed, current where the
+        # layer being printed lies between its lowest and highest
+        black = '\0\0\0'
+        done = ''.join(map(chr, self.done))
+        current = ''.join(map(chr, self.current))
+        pending = ''.join(map(chr, self.pending))
+
+        pixels = []
+        for low, high in zip(layer_map.low, layer_map.high):
+            if low == LayerMap.empty:
+                pixels.append(black)
+            elif high < layer:
+                pixels.append(done)
+            elif low <= layer:
+                pixels.append(current)
+            else:
+                pixels.append(pending)
+
+        image = pygame.image.fromstring(''.join(pixels), (self.size, self.size), 'RGB')
+        self.surface.blit(image, (0, 0))
+
+    def stop(self):
+        self.stopped.set()
+########## end gcode preview classes ##########
+
+########## start file browser classes ##########
+#
+# the files on a server are listed once and kept on disk, and opening the
+# browser asks the server whether the list changed since with the ETag and
+# Last-Modified it came with. only the rows that can be seen are drawn,
+# from the text cache, so a list of thousands scrolls like a short one.
+# a drag moves the list with the finger and keeps going after a flick.
+
+class FileList(object):
+    def __init__(self, client, cache_dir):
+        self.client = client
+        self.path = os.path.join(cache_dir, hashlib.sha1(client.url).hexdigest() + '.json')
+        self.files = []
+        self.etag = None
+        self.last_modified = None
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+        # called from the refreshing thread when the list changed
+        self.on_change = None
+
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as list_file:
+                    saved = json.load(list_file)
+                self.files = saved['files']
+                self.etag = saved['etag']
+                self.last_modified = saved['last_modified']
+        except (IOError, ValueError, KeyError) as e:
+            log.warning("can't read file list %s: %s", self.path, e)
+
+    def flatten(self, entries):
+        # only what a row shows and starting a print needs is kept
+        files = []
+        for entry in entries:
+            if entry.get('type') == 'folder':
+                files.extend(self.flatten(entry.get('children', [])))
+            elif entry.get('type') == 'machinecode':
+                files.append({'name': entry['name'], 'path': entry['path'], 'origin': entry['origin'], 'size': entry.get('size'), 'date': entry.get('date')})
+        return files
+
+    def refresh(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        worker = threading.Thread(target=self.fetch)
+        worker.daemon = True
+        worker.start()
+
+    def fetch(self):
+        try:
+            body, etag, last_modified = self.client.revalidate('files?recursive=true', self.etag, self.last_modified)
+            if body is None:
+                return
+
+            # newest first, that is what is usually printed next
+            files = self.flatten(body.get('files', []))
+            files.sort(key=lambda entry: entry['date'] or 0, reverse=True)
+
+            self.files = files
+            self.etag = etag
+            self.last_modified = last_modified
+            log.info("%d files on %s", len(files), self.client.url)
+
+            self.save()
+            if self.on_change is not None:
+                self.on_change()
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def save(self):
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+
+            with open(self.path + '.tmp', 'w') as list_file:
+                json.dump({'files': self.files, 'etag': self.etag, 'last_modified': self.last_modified}, list_file)
+            os.rename(self.path + '.tmp', self.path)
+        except (IOError, OSError) as e:
+            log.warning("can't save file list %s: %s", self.path, e)
+
+class FileBrowser(object):
+    row_height = 44
+    tap_distance = 10
+    min_speed = 20
+    name_color = (255, 255, 255)
+    detail_color = (150, 150, 150)
+    line_color = (40, 40, 40)
+
+    def __init__(self, rect, font, small_font, friction=0.05):
+        self.rect = pygame.Rect(rect)
+        self.font = font
+        self.small_font = small_font
+        self.surface = pygame.Surface(self.rect.size).convert()
+
+        # fraction of its speed a flick still has after a second
+        self.friction = friction
+        self.files = None
+        self.offset = 0.0
+        self.velocity = 0.0
+        self.drag = None
+        self.moved = 0
+        self.stepped = 0
+        self.shown = None
+
+    def open(self, files):
+        self.files = files
+        self.offset = 0.0
+        self.velocity = 0.0
+        self.drag = None
+        self.shown = None
+
+    def scroll_to(self, offset):
+        limit = max(0, len(self.files.files) * self.row_height - self.rect.height)
+        self.offset = min(max(offset, 0), limit)
+        return self.offset in (0, limit)
+
+    def press(self, pos, now):
+        self.velocity = 0.0
+        self.drag = (pos[1], now)
+        self.moved = 0
+
+    def move(self, pos, now):
+        if self.drag is None:
+            return
+
+        y, then = self.drag
+        self.scroll_to(self.offset - (pos[1] - y))
+        self.moved += abs(pos[1] - y)
+
+        # smoothed, single motion events are far from regular
+        if now > then:
+            self.velocity = 0.5 * self.velocity + 0.5 * (y - pos[1]) / (now - then)
+        self.drag = (pos[1], now)
+
+    def release(self, pos, now):
+        # the row tapped, None when the touch was a drag
+        if self.drag is None:
+            return None
+
+        self.move(pos, now)
+        self.drag = None
+        self.stepped = now
+
+        if self.moved < self.tap_distance:
+            self.velocity = 0.0
+            index = int((pos[1] - self.rect.top + self.offset) // self.row_height)
+            if 0 <= index < len(self.files.files):
+                return self.files.files[index]
+        return None
+
+    def moving(self):
+        return self.drag is None and self.velocity != 0
+
+    def step(self, now):
+        elapsed = now - self.stepped
+        self.stepped = now
+
+        at_end = self.scroll_to(self.offset + self.velocity * elapsed)
+        self.velocity *= self.friction ** elapsed
+        if at_end or abs(self.velocity) < self.min_speed:
+            self.velocity = 0.0
+
+    def row(self, entry):
+        detail = ""
+        if entry['size'] is not None:
+            detail = "{:,}".format(entry['size']) + " Bytes"
+        if entry['date']:
+            detail += "  " + time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['date']))
+        return entry['name'].replace(".gcode", "")[:34], detail
+
+    def update(self):
+        # draws the rows in view, returns whether anything changed
+        files = self.files.files
+        if self.shown is None or files is not self.shown[0]:
+            # a list that was refreshed may have got shorter
+            self.scroll_to(self.offset)
+
+        offset = int(self.offset)
+        if self.shown is not None and files is self.shown[0] and offset == self.shown[1]:
+            return False
+
+        self.surface.fill((0, 0, 0))
+        first = offset // self.row_height
+        last = min(len(files), (offset + self.rect.height) // self.row_height + 1)
+        for index in range(first, last):
+            y = index * self.row_height - offset
+            name, detail = self.row(files[index])
+            self.surface.blit(text_cache.render(self.font, name, True, self.name_color), (5, y + 3))
+            self.surface.blit(text_cache.render(self.small_font, detail, True, self.detail_color), (5, y + 24))
+            pygame.draw.line(self.surface, self.line_color, (0, y + self.row_height - 1), (self.rect.width, y + self.row_height - 1))
+
+        self.shown = (files, offset)
+        return True
+########## end file browser classes ##########
+
+########## start webcam classes ##########
+#
+# with "webcam" set, tapping the graph opens the printer's camera. a thread
+# of its own fetches snapshots at webcam_fps while the panel is open,
+# decodes them and scales them to the panel once. only the newest frame is
+# kept: one the display had no time for is dropped, not queued, and when
+# decoding can't keep up the next snapshot is simply fetched later.
+
+class WebcamFeed(threading.Thread):
+    def __init__(self, url, size, fps, timeout):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.url = url
+        self.size = size
+        self.interval = 1.0 / fps
+        self.timeout = timeout
+        self.active = threading.Event()
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.surface = pygame.Surface(size).convert()
+        self.surface.fill((0, 0, 0))
+
+        # newest frame not yet shown
+        self.frame = None
+        self.frames = 0
+        self.dropped = 0
+
+        # called from the feed's thread when there is a new frame
+        self.on_change = None
+
+    def scale(self, image):
+        # to fit the panel, keeping the camera's aspect ratio
+        width, height = image.get_size()
+        factor = min(float(self.size[0]) / width, float(self.size[1]) / height)
+        return pygame.transform.smoothscale(image, (max(1, int(width * factor)), max(1, int(height * factor))))
+
+    def fetch(self, session):
+        try:
+            response = session.get(self.url, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            log.info("webcam snapshot failed: %s", e)
+            return None
+
+        if response.status_code != 200:
+            log.info("webcam snapshot failed: %s", response.status_code)
+            return None
+
+        try:
+            return self.scale(pygame.image.load(io.BytesIO(response.content), 'snapshot.jpg'))
+        except pygame.error as e:
+            log.info("can't decode webcam snapshot: %s", e)
+            return None
+
+    def run(self):
+        session = load_requests().Session()
+
+        while not self.stopped.is_set():
+            # nothing is fetched while the panel is closed
+            if not self.active.wait(1):
+                continue
+
+            started = time.time()
+            frame = self.fetch(session)
+            if frame is not None:
+                with self.lock:
+                    if self.frame is not None:
+                        self.dropped += 1
+                    self.frame = frame
+                    self.frames += 1
+
+                if self.on_change is not None:
+                    self.on_change()
+
+            remaining = self.interval - (time.time() - started)
+            if remaining > 0:
+                self.stopped.wait(remaining)
+
+    def show(self):
+        # called for every frame of the panel, returns whether the surface
+        # changed. it is kept as it is until the next snapshot.
+        with self.lock:
+            frame = self.frame
+            self.frame = None
+
+        if frame is None:
+            return False
+
+        self.surface.fill((0, 0, 0))
+        self.surface.blit(frame, ((self.size[0] - frame.get_width()) // 2, (self.size[1] - frame.get_height()) // 2))
+        return True
+
+    def stop(self):
+        self.stopped.set()
+        self.active.set()
+########## end webcam classes ##########
+
+########## start power management classes ##########
+#
+# with power_mode "backlight" the Matrix screensaver is replaced by dimming
+# and then switching off the backlight. nothing is rendered while it is
+# dark. dark_hours, e.g. [23, 7] in the configured timezone, keeps the screen
+# dark overnight unless a job is printing.
+
+AWAKE = 'awake'
+DIM = 'dim'
+DARK = 'dark'
+
+class PowerManager(object):
+    def __init__(self, path, dim_after, off_after, dim_level, dark_hours):
+        self.path = path
+        self.dim_after = dim_after
+        self.off_after = off_after
+        self.dark_hours = dark_hours
+        self.level = None
+
+        # full brightness is max_brightness next to the brightness file, or
+        # failing that whatever the panel is at right now, unless an earlier
+        # run left it off
+        current = self.read(path)
+        if current == "0":
+            current = None
+        self.on = self.read(os.path.join(os.path.dirname(path), 'max_brightness')) or current or "1"
+        dim = int(int(self.on) * dim_level)
+
+        # on/off only panels can't dim
+        if dim < 1:
+            self.dim = None
+        else:
+            self.dim = str(dim)
+
+        self.write(AWAKE, self.on)
+
+    def read(self, path):
+        try:
+            with open(path, 'r') as value:
+                return value.read().strip() or None
+        except IOError:
+            return None
+
+    def write(self, level, state):
+        try:
+            backLight(state, self.path)
+        except IOError as e:
+            log.warning("can't set backlight %s: %s", self.path, e)
+        log.debug("backlight %s (%s)", level, state)
+        self.level = level
+
+    def night(self):
+        if not self.dark_hours:
+            return False
+
+        start, end = self.dark_hours
+        hour = clock.now().hour
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def update(self, idle, printing):
+        # a touch at night keeps the screen on for as long as it would stay
+        # fully lit by day
+        touched = idle < (self.dim_after or self.off_after or 0)
+
+        if self.night() and not printing and not touched:
+            level = DARK
+        elif self.off_after and idle >= self.off_after:
+            level = DARK
+        elif self.dim_after and idle >= self.dim_after and self.dim is not None:
+            level = DIM
+        else:
+            level = AWAKE
+
+        if level != self.level:
+            self.write(level, {AWAKE: self.on, DIM: self.dim, DARK: "0"}[level])
+
+        return self.level
+
+    def wake(self):
+        if self.level != AWAKE:
+            self.write(AWAKE, self.on)
+
+    def next_change(self, idle):
+        # seconds until update() could pick a different level
+        pending = [after - idle for after in (self.dim_after, self.off_after) if after and after > idle]
+
+        # the schedule is checked once a minute
+        if self.dark_hours:
+            pending.append(60)
+
+        if pending:
+            return min(pending)
+        return None
+########## end power management classes ##########
+
+########## start scheduler classes ##########
+#
+# instead of redrawing at a fixed rate the display sleeps in
+# pygame.event.wait() until a touch, a new status snapshot, or a timer set
+# for the next moment the screen has to change.
+
+STATUS_EVENT = USEREVENT + 1
+TICK_EVENT = USEREVENT + 2
+
+class Scheduler(object):
+    def __init__(self):
+        self.wakeups = 0
+
+    def notify(self):
+        # called from other threads, e.g. when the poller has new data
+        try:
+            pygame.event.post(pygame.event.Event(STATUS_EVENT))
+        except pygame.error:
+            pass
+
+    def wait(self, timeout):
+        if timeout is not None and timeout <= 0:
+            return pygame.event.get()
+
+        # a one-shot timer bounds the wait, cancelled once anything arrives
+        if timeout is not None:
+            pygame.time.set_timer(TICK_EVENT, max(1, int(timeout * 1000)))
+
+        events = [pygame.event.wait()]
+        events.extend(pygame.event.get())
+
+        if timeout is not None:
+            pygame.time.set_timer(TICK_EVENT, 0)
+
+        self.wakeups += 1
+        return events
+########## end scheduler classes ##########
+
+########## start display classes ##########
+#
+# SdlDisplay presents through pygame.display. FramebufferDisplay draws into
+# an off-screen surface in the framebuffer's own pixel format, so blits do
+# the RGB565 conversion, and copies changed rectangles straight into an mmap
+# of the device. that needs neither fbcon nor the SDL 1.2 downgrade. any
+# file of the right size works as a fake framebuffer.
+
+FBIOGET_VSCREENINFO = 0x4600
+FBIOGET_FSCREENINFO = 0x4602
+
+class SdlDisplay(object):
+    def __init__(self, size):
+        self.surface = pygame.display.set_mode(size)
+        pygame.mouse.set_visible(False)
 
-home = expanduser("~")
-with open(home + '/.octoprint_apikey', 'r') as apikey:
-    dat_key = apikey.read().replace('\n', '')
+    def update(self, rects):
+        pygame.display.update(rects)
 
-########## start screen saver classes ##########
+    def flip(self):
+        pygame.display.flip()
+
+class FramebufferDisplay(object):
+    def __init__(self, device, size):
+        self.file = open(device, 'r+b')
+        width, height, bits, masks, line_length = self.geometry(size)
+
+        if (width, height) != tuple(size):
+            log.warning("%s is %dx%d, drawing %dx%d into its corner", device, width, height, size[0], size[1])
+
+        # SDL still provides events, timers and surface conversion
+        pygame.display.set_mode((1, 1))
+
+        self.surface = pygame.Surface(size, 0, bits, masks)
+        self.bounds = pygame.Rect(0, 0, min(width, size[0]), min(height, size[1]))
+        self.full_rows = width == size[0] and line_length == self.surface.get_pitch()
+        self.line_length = line_length
+        self.map = mmap.mmap(self.file.fileno(), line_length * height)
+        self.address = ctypes.addressof(ctypes.c_char.from_buffer(self.map))
+
+    def geometry(self, size):
+        try:
+            var = fcntl.ioctl(self.file, FBIOGET_VSCREENINFO, '\0' * 160)
+            fix = fcntl.ioctl(self.file, FBIOGET_FSCREENINFO, '\0' * 128)
+        except IOError:
+            # a plain file, taken to be RGB565 at the size drawn
+            return size[0], size[1], 16, (0xF800, 0x07E0, 0x001F, 0), size[0] * 2
+
+        info = struct.unpack_from('20I', var)
+        width, height, bits = info[0], info[1], info[6]
+        masks = tuple(((1 << info[9 + i * 3]) - 1) << info[8 + i * 3] for i in range(4))
+        line_length = struct.unpack_from('16sL4I3HI', fix)[-1]
+        return width, height, bits, masks, line_length
+
+    def update(self, rects):
+        source = self.surface._pixels_address
+        pitch = self.surface.get_pitch()
+        depth = self.surface.get_bytesize()
+
+        # plain memory copies, the pixels are already in the device's format
+        for rect in rects:
+            rect = self.bounds.clip(rect)
+            if not rect.width or not rect.height:
+                continue
+
+            if self.full_rows and rect.width == self.bounds.width:
+                ctypes.memmove(self.address + rect.top * pitch, source + rect.top * pitch, rect.height * pitch)
+                continue
+
+            length = rect.width * depth
+            for y in range(rect.top, rect.bottom):
+                ctypes.memmove(self.address + y * self.line_length + rect.left * depth, source + y * pitch + rect.left * depth, length)
+
+    def flip(self):
+        self.update([self.bounds])
+
+# set up by main()
+display = None
+########## end display classes ##########
+
+########## start input classes ##########
 #
-# Matrix code borrowed and modified from Dylan J. Raub (dylanjraub)
-# http://pygame.org/project-Matrix+code-756-.html
+# touches are hit-tested against the widgets on screen through an index of
+# horizontal bands, so a tap only looks at the widgets on its own row. a
+# press is debounced against the previous one and the pressed widget is
+# redrawn and presented before anything else in the frame is looked at.
 
-class CodePartical(object):
-    def __init__(self, pos, frame, code):
-        self.pos = [int(pos[0]),int(pos[1])]
-        self.frame = int(frame)
-        self.max_life = 30
-        self.life = int(self.max_life)
-        self.fade_time = 5
-        self.code =  code
-        self.dead = False
-
-    def modernize(self, text, size):
-        self.frame+=random.randint(1,3)/10.0
-        if self.frame>=len(self.code):
-            self.frame = 0
-
-        self.life-=1
-        if self.life<=0:
-            self.dead = True
-            
-    def render(self, screen, text):
-        if self.life>self.fade_time:
-            color = [ 0*(float(self.life-self.fade_time)/(self.max_life-self.fade_time)) , 0 , 255*(float(self.life-self.fade_time)/(self.max_life-self.fade_time)) ]
-        else:
-            color = [ 100 , 100*(float(self.life)/self.fade_time) , 255 ]
-            
-        text_surface =  text.render(self.code[int(self.frame)], False, color)
-        rect = text_surface.get_rect(center = self.pos)
+class Button(object):
+    def __init__(self, name, rect, label=None, value=None):
+        self.name = name
+        self.rect = pygame.Rect(rect)
+        self.label = label
+        self.value = value
+        self.pressed = False
 
-        screen.blit(text_surface, rect)
+class HitIndex(object):
+    def __init__(self, height, band=40):
+        self.band = band
+        self.bands = [[] for i in range(height // band + 1)]
 
-        return [rect]
+    def add(self, widget):
+        for band in range(widget.rect.top // self.band, (widget.rect.bottom - 1) // self.band + 1):
+            if 0 <= band < len(self.bands):
+                self.bands[band].append(widget)
 
-class Group(object): 
-    def __init__(self, pos, speed):
-	# "matrix code" is a string made up of the current timezone/time/date
-	timedata = datetime.now(timezone(default_timezone))
-	timestring = timedata.strftime('%X %Z %z') + default_timezone
-	self.code = list(timestring)
-	random.shuffle(self.code, random.random)
-	
-	self.speed=int(speed)
-	self.pos =[  int(pos[0]),int(pos[1]) ]
-	self.frame = 0
-	self.update = 0
-	self.particals = [CodePartical(self.pos, self.frame, self.code)]
-	self.dead=False
-        
-    def modernize(self, text, size):
-        self.update+=1
-        if self.update==self.speed:
-            self.update=0
-            
-            if self.pos[1]<size[1]:
-                self.pos[1]+=text.get_height()
-                self.particals.append(CodePartical(self.pos, int(self.frame), self.code))
+    def clear(self):
+        for band in self.bands:
+            del band[:]
 
-            if len(self.particals)==0:
-                self.dead = True           
+    def hit(self, pos):
+        band = pos[1] // self.band
+        if not 0 <= band < len(self.bands):
+            return None
 
-        for partical in self.particals:
-            partical.modernize(text, size)
-            if partical.dead:
-                self.particals.remove(partical)
+        # widgets added later are on top
+        for widget in reversed(self.bands[band]):
+            if widget.rect.collidepoint(pos):
+                return widget
+        return None
 
-        self.frame+=1
-        if self.frame>=len(self.code):
-            self.frame=0     
+# without SDL's tslib mouse driver touches are read from the evdev device
+# and posted as pygame mouse events
 
-    def render(self, screen, text):
-        rects = []
-        
-        for partical in self.particals:
-            rects.append(  partical.render(screen, text)[0]  )
+EV_SYN = 0
+EV_KEY = 1
+EV_ABS = 3
+ABS_X = 0
+ABS_Y = 1
+BTN_TOUCH = 0x14a
+EVIOCGABS = 0x80184540
 
-        return rects
-########## end screen saver classes ##########
+class TouchReader(threading.Thread):
+    def __init__(self, device, size, swap_xy=False, invert_x=False, invert_y=False):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.fd = os.open(device, os.O_RDONLY)
+        self.size = size
+        self.swap_xy = swap_xy
+        self.invert_x = invert_x
+        self.invert_y = invert_y
+        self.ranges = [self.axis_range(ABS_X), self.axis_range(ABS_Y)]
+        self.raw = [0, 0]
+        self.stopped = threading.Event()
+        self.event_format = 'llHHi'
+        self.event_size = struct.calcsize(self.event_format)
 
-def get_script_path():
-    return os.path.dirname(os.path.realpath(sys.argv[0]))
+    def axis_range(self, axis):
+        try:
+            info = struct.unpack('6i', fcntl.ioctl(self.fd, EVIOCGABS + axis, '\0' * 24))
+            return info[1], info[2]
+        except IOError:
+            return 0, 4095
 
-def getIPAddr(ifname):
-    retval = ""
-    
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        retval = socket.inet_ntoa(fcntl.ioctl(s.fileno(), 0x8915, struct.pack('256s', ifname[:15]))[20:24])
-    except:
-        retval = None
-        
-    if retval == None:
-        return "000.000.000.000"
-    else:
-        return retval
+    def position(self):
+        scaled = []
+        for raw, (low, high) in zip(self.raw, self.ranges):
+            scaled.append(float(raw - low) / max(1, high - low))
 
-def getHWAddr(ifname):
-    retval = ""
-    
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        info = fcntl.ioctl(s.fileno(), 0x8927,  struct.pack('256s', ifname[:15]))
-        retval = ''.join(['%02x:' % ord(char) for char in info[18:24]])[:-1]
-    except:
-        retval = None
-    
-    if retval == None:
-        return "00:00:00:00:00:00"
-    else:
-        return retval
+        if self.swap_xy:
+            scaled.reverse()
+        if self.invert_x:
+            scaled[0] = 1 - scaled[0]
+        if self.invert_y:
+            scaled[1] = 1 - scaled[1]
 
-def headers():
-    global dat_key
-    
-    headers = {
-        'Content-Type': 'application/json',
-	'X-Api-Key': dat_key
-    }
+        return (min(self.size[0] - 1, max(0, int(scaled[0] * self.size[0]))),
+                min(self.size[1] - 1, max(0, int(scaled[1] * self.size[1]))))
 
-    return headers
+    def run(self):
+        pending = None
+        touching = False
+        moved = False
 
-def ctrl_c(signal, frame):
-    pygame.quit() 
+        while not self.stopped.is_set():
+            if not select.select([self.fd], [], [], 1)[0]:
+                continue
 
-def get_info(api_path):
-    response = requests.get("http://octopi.inditech.org/api/" + api_path, headers = headers())
+            data = os.read(self.fd, self.event_size * 64)
+            for offset in range(0, len(data) - self.event_size + 1, self.event_size):
+                seconds, micros, kind, code, value = struct.unpack_from(self.event_format, data, offset)
 
-    if response.status_code == 200:
-        return json.loads(response.content.decode('utf-8'))
-    else:
+                if kind == EV_ABS and code in (ABS_X, ABS_Y):
+                    self.raw[code] = value
+                    moved = True
+                elif kind == EV_KEY and code == BTN_TOUCH:
+                    pending = value
+
+                # a report ends each batch, by then the position is current
+                elif kind == EV_SYN and pending is not None:
+                    if pending:
+                        event = MOUSEBUTTONDOWN
+                    else:
+                        event = MOUSEBUTTONUP
+                    pygame.event.post(pygame.event.Event(event, pos = self.position(), button = 1))
+                    touching = bool(pending)
+                    pending = None
+                    moved = False
+
+                # dragging a finger, for lists that scroll
+                elif kind == EV_SYN and touching and moved:
+                    pygame.event.post(pygame.event.Event(MOUSEMOTION, pos = self.position(), rel = (0, 0), buttons = (1, 0, 0)))
+                    moved = False
+
+    def stop(self):
+        self.stopped.set()
+
+class TouchInput(object):
+    def __init__(self, debounce):
+        self.debounce = debounce
+        self.last_press = 0
+        self.pressed = None
+
+    def order(self, events):
+        # touches are handled ahead of anything else that woke the loop
+        return sorted(events, key=lambda event: event.type not in (MOUSEBUTTONDOWN, MOUSEMOTION, MOUSEBUTTONUP))
+
+    def press(self, pos, hits):
+        # a second press this soon is the panel bouncing, not a new touch
+        now = time.time()
+        if now - self.last_press < self.debounce:
+            return False
+
+        self.last_press = now
+        self.pressed = hits.hit(pos)
+        if self.pressed is not None:
+            self.pressed.pressed = True
+        return True
+
+    def cancel(self):
+        if self.pressed is not None:
+            self.pressed.pressed = False
+        self.pressed = None
+
+    def release(self, pos):
+        # a widget fires when the touch is released over it
+        widget = self.pressed
+        self.cancel()
+
+        if widget is not None and widget.rect.collidepoint(pos):
+            return widget
         return None
+########## end input classes ##########
 
-def post_info(api_path, command):
-    response = requests.post("http://octopi.inditech.org/api/" + api_path, headers = headers(), data = json.dumps(command))
-    if response.status_code == 200:
-        return json.loads(response.content.decode('utf-8'))
-    else:
-	return None
+########## start status renderer classes ##########
+#
+# the background surface is kept between frames and each line remembers
+# what it last showed. only lines whose text changed are re-rendered, and
+# only their rectangles are pushed to the display, which over SPI is the
+# slowest step of a frame.
 
-def CtoF(value):
-    return `int(round(9 / 5 * value + 32))`
+class StatusRenderer(object):
+    def __init__(self, screen, font, bgcolor):
+        self.screen = screen
+        self.font = font
+        self.bgcolor = bgcolor
+        self.background = createSurface(screen, bgcolor)
+        self.lines = {}
+        self.images = set()
+        self.buttons = {}
+        self.dirty = []
 
-def rptstr(str, cnt):
-    return ''.join([char * cnt for char in str])
+        # pixels pushed to the display, reported once a second
+        self.pixels = 0
+        self.pixels_per_second = 0
+        self.counted_since = time.time()
 
-def setProgress(surface, percent):
-    WHITE = (255,255,255)
-    pygame.draw.rect(surface, WHITE, (5, 65, 470, 40), 2)
-    
-    if percent >= 7:
-        pygame.draw.rect(surface, WHITE, (14, 70, 30, 30))
-    if percent >= 16:
-	pygame.draw.rect(surface, WHITE, (49, 70, 30, 30))
-    if percent >= 24:
-	pygame.draw.rect(surface, WHITE, (84, 70, 30, 30))
-    if percent >= 31:
-	pygame.draw.rect(surface, WHITE, (119, 70, 30, 30))
-    if percent >= 39:
-	pygame.draw.rect(surface, WHITE, (154, 70, 30, 30))
-    if percent >= 45:
-	pygame.draw.rect(surface, WHITE, (189, 70, 30, 30))
-    if percent >= 52:
-        pygame.draw.rect(surface, WHITE, (224, 70, 30, 30))
-    if percent >= 60:
-        pygame.draw.rect(surface, WHITE, (260, 70, 30, 30))
-    if percent >= 69:
-	pygame.draw.rect(surface, WHITE, (295, 70, 30, 30))
-    if percent >= 78:
-	pygame.draw.rect(surface, WHITE, (330, 70, 30, 30))
-    if percent >= 85:
-	pygame.draw.rect(surface, WHITE, (365, 70, 30, 30))
-    if percent >= 92:
-	pygame.draw.rect(surface, WHITE, (401, 70, 30, 30))
-    if percent >= 100:
-	pygame.draw.rect(surface, WHITE, (437, 70, 30, 30))
+    def text(self, x, y, text, color):
+        previous = self.lines.get((x, y))
+        if previous is not None and previous[0] == (text, color):
+            return
 
-def createSurface(screen, bgcolor):
-    bground = pygame.Surface(screen.get_size())
-    bground = bground.convert()
-    bground.fill(bgcolor)
-		
-    return bground
+        if previous is not None:
+            self.background.fill(self.bgcolor, previous[1])
+            self.dirty.append(previous[1])
 
-def backLight(state):
-    file = open("/sys/class/backlight/soc:backlight/brightness","w") 
-    file.write(state)
-    file.close()
-    return
+        rect = pygame.Rect(x, y, 0, 0)
+        if text:
+            rect = printText(self.font, color, text, self.background, x, y)
+            self.dirty.append(rect)
 
-def printText(font, color, text, background, x, y):
-    item = font.render(text, True, color)
-    background.blit(item, (x, y))
-    return
+        self.lines[(x, y)] = ((text, color), rect)
 
-def confirm(screen, message):
-    return_val = False
-    button_clicked = False
-    
+    def button(self, button, font, color):
+        state = (button.label, button.pressed)
+        if self.buttons.get(button.name) == state:
+            return
+
+        # pressed buttons are drawn inverted
+        foreground, fill = color, self.bgcolor
+        if button.pressed:
+            foreground, fill = self.bgcolor, color
+
+        self.background.fill(fill, button.rect)
+        pygame.draw.rect(self.background, color, button.rect, 2)
+        label = text_cache.render(font, button.label, True, foreground)
+        self.background.blit(label, label.get_rect(center = button.rect.center))
+
+        self.dirty.append(button.rect)
+        self.buttons[button.name] = state
+
+    def image(self, x, y, surface, changed):
+        if changed or (x, y) not in self.images:
+            self.dirty.append(self.background.blit(surface, (x, y)))
+            self.images.add((x, y))
+
+    def invalidate(self):
+        # something else drew over the screen, repaint all of it
+        self.background.fill(self.bgcolor)
+        self.lines = {}
+        self.images = set()
+        self.buttons = {}
+        self.dirty = [self.background.get_rect()]
+
+    def count(self, rects):
+        for rect in rects:
+            self.pixels += rect.width * rect.height
+
+        now = time.time()
+        if now - self.counted_since >= 1:
+            self.pixels_per_second = int(self.pixels / (now - self.counted_since))
+            self.pixels = 0
+            self.counted_since = now
+            log.debug("pushed %d pixels/s", self.pixels_per_second)
+
+    def present(self):
+        if self.dirty:
+            for rect in self.dirty:
+                self.screen.blit(self.background, rect, rect)
+
+            display.update(self.dirty)
+
+        self.count(self.dirty)
+        self.dirty = []
+########## end status renderer classes ##########
+
+def confirm(screen, message, touch):
     WHITE = (255,255,255)
     BLACK = (0,0,0)
-    
-    Button1 = pygame.Rect(160, 235, 150, 75)
-    Button2 = pygame.Rect(320, 235, 150, 75)
-    font = pygame.font.Font(get_script_path() + "/Fonts/NotoMono-Regular.ttf", 15)
-    background = createSurface(screen, BLACK)
-    
-    printText(font, WHITE, message, background, 5,5)
-    pygame.draw.rect(background, WHITE, Button1, 2)
-    background.blit(font.render("Yes", True, WHITE), (215,270))
-            
-    pygame.draw.rect(background, WHITE, Button2, 2)
-    background.blit(font.render("No", True, WHITE), (395,270))
 
-    screen.blit(background, (0, 0))
-    pygame.display.flip()
-    
-    clock = pygame.time.Clock()
+    font = load_font(15)
+    dialog = StatusRenderer(screen, font, BLACK)
+    dialog.invalidate()
+
+    yes = Button('yes', (10, 235, 145, 75), "Yes")
+    no = Button('no', (165, 235, 145, 75), "No")
+    hits = HitIndex(screen.get_height())
+    hits.add(yes)
+    hits.add(no)
+
+    y = 5
+    for line in textwrap.wrap(message, 34):
+        dialog.text(5, y, line, WHITE)
+        y += 25
+
     while True:
-        clock.tick(15)
-        
-        for event in pygame.event.get():
-            mouse_pos = pygame.mouse.get_pos()
-            
+        dialog.button(yes, font, WHITE)
+        dialog.button(no, font, WHITE)
+        dialog.present()
+
+        # nothing changes on this screen until it is touched
+        for event in touch.order([pygame.event.wait()] + pygame.event.get()):
             if event.type == QUIT:
-                return
-            
+                # main() has to see it too
+                pygame.event.post(event)
+                return False
+
             elif event.type == MOUSEBUTTONDOWN:
-                pygame.event.set_blocked(MOUSEBUTTONDOWN)
-                
-                #if Button1.collidepoint(mouse_pos):
-                #    pygame.draw.rect(background, WHITE, Button3)
-                #    background.blit(font.render("Yes", True, BLACK), (275,192))
-                #    
-                #if Button2.collidepoint(mouse_pos):
-                #    pygame.draw.rect(background, WHITE, Button4)
-                #    background.blit(font.render("No", True, BLACK), (386,192))
-                    
+                touch.press(event.pos, hits)
+
             elif event.type == MOUSEBUTTONUP:
-		pygame.event.set_allowed(MOUSEBUTTONDOWN)
-                #if Button1.collidepoint(mouse_pos):
-                #    pygame.draw.rect(background, WHITE, Button1, 2)
-                #    background.blit(font.render("Yes", True, BLACK), (35,192))
-                #    return_val = True
-                #    button_clicked = True
-                #    
-                #if Button2.collidepoint(mouse_pos):
-                #    pygame.draw.rect(background, WHITE, Button2, 2)
-                #    background.blit(font.render("No", True, BLACK), (152,192))
-                #    return_val = False
-                #    button_clicked = True
-            
-            if button_clicked == True:
-                return return_val
+                button = touch.release(event.pos)
+                if button is not None:
+                    return button is yes
 
 def main():
     global index
     global wclient
+    global display
     
     WHITE = (255,255,255)
     BLACK = (0,0,0)
 	
-    runtime = 0
-    ssaver_time = 720
+    ssaver_after = config['screensaver_after']
+    saver_interval = 1.0 / 15
+    poll_interval = 0.25
+    stale_after = 5
+    max_interfaces = 4
     screensaver_on = False
-    return_from_ss = False
-    api_version = "0"
-    octo_version = "0"
-    ext_target_f = "0"
-    bed_target_f = "0"
-    ds = u'\N{DEGREE SIGN}'
-    is_paused = False
-    pause_text = "Pause"
 
     signal.signal(signal.SIGINT, ctrl_c)
+    signal.signal(signal.SIGTERM, ctrl_c)
+
+    # Initialise screen. only the parts of pygame that are used, audio and
+    # joysticks take a while to probe
+    pygame.display.init()
+    pygame.font.init()
+
+    touch_reader = None
+    if config['display'] == 'framebuffer':
+        display = FramebufferDisplay(config['framebuffer'], (320, 480))
+
+        if config['touch_device']:
+            try:
+                touch_reader = TouchReader(config['touch_device'], (320, 480), config['touch_swap_xy'], config['touch_invert_x'], config['touch_invert_y'])
+                touch_reader.start()
+            except OSError as e:
+                log.warning("no touch input: %s", e)
+    else:
+        display = SdlDisplay((320, 480))
+    screen = display.surface
+
+    # put the last known state up straight away, threads and the network
+    # come after the first pixel
+    splash = show_cached_frame(screen, config['frame_cache'])
+    log.info("first frame %.0f ms after start%s", process_age() * 1000, " (cached)" if splash else "")
+    profiler.counters['first_frame_ms'] = int(process_age() * 1000)
+
+    # interface addresses are watched in the background too
+    interfaces = InterfaceCache(config['interfaces'], config['interface_refresh'])
+    interfaces.start()
+
+    # fetch printer data in the background
+    printers = create_printers(poll_interval)
+    for printer in printers:
+        printer.start()
 
-    # Initialise screen
-    pygame.init()
-    screen = pygame.display.set_mode((320, 480))
-    pygame.mouse.set_visible(False)
+    # several printers start on the overview, one goes straight to its
+    # details
+    selected = 0
+    page = 0
+    overview_rows = 9
+    if len(printers) > 1:
+        selected = None
     
-    #Button1 = pygame.Rect(5, 152, 100, 100)
-    #Button2 = pygame.Rect(127, 152, 100, 100)
-    #Button3 = pygame.Rect(250, 152, 100, 100)
-    #Button4 = pygame.Rect(371, 152, 100, 100)
+    # job and system controls under the interfaces, which then get one
+    # row less
+    controls = [
+        Button('pause', (5, 285, 56, 40), "Pause"),
+        Button('cancel', (65, 285, 56, 40), "Cancel"),
+        Button('files', (125, 285, 56, 40), "Files"),
+        Button('reboot', (185, 285, 56, 40), "Reboot"),
+        Button('poweroff', (245, 285, 70, 40), "Power Off")
+    ]
+    if config['controls']:
+        max_interfaces = 3
+    back = Button('back', (0, 0, 320, 130))
+    close = Button('close', (5, 2, 70, 38), "Back")
+    camera = Button('camera', (0, 355, 320, 125))
+
+    # None, or the file browser or camera shown instead of the details
+    panel = None
+
+    touch = TouchInput(config['debounce'])
+    hits = HitIndex(480)
+    shown = None
 	
     # create font
-    font = pygame.font.Font(get_script_path() + "/Fonts/NotoMono-Regular.ttf", 15)
+    font = load_font(15)
+    small_font = load_font(12)
+    renderer = StatusRenderer(screen, font, BLACK)
+    renderer.invalidate()
+    browser = FileBrowser((0, 45, 320, 435), font, small_font)
+    background = renderer.background
 	
+    power = None
+    if config['power_mode'] == 'backlight':
+        power = PowerManager(config['backlight'], config['dim_after'], config['off_after'], config['dim_level'], config['dark_hours'])
+
     # main loop that shows and cycles time
     pos = (0, 0)
-    clock = pygame.time.Clock()
+    scheduler = Scheduler()
+    for printer in printers:
+        printer.poller.on_change = scheduler.notify
+
+    # other consumers get the same data from here
+    status_server = None
+    if config['status_port']:
+        try:
+            status_server = StatusServer(printers, config['status_bind'], config['status_port'])
+        except socket.error as e:
+            log.warning("can't serve status on port %s: %s", config['status_port'], e)
+
+    if status_server is not None:
+        status_server.on_change = scheduler.notify
+        for printer in printers:
+            printer.poller.on_change = status_server.changed
+        status_server.start()
+    last_touch = time.time()
+    timeout = 0
+
+    # the cached frame stays up until there is fresh data, or for as long
+    # as stale data would be shown before saying so
+    splash_until = time.time() + stale_after
+    first_status = True
+
     while True:
-        clock.tick(15)
-        
-        for event in pygame.event.get():
-            mouse_pos = pygame.mouse.get_pos()
-            
+        events = scheduler.wait(timeout)
+        received = time.time()
+        profiler.begin()
+
+        for event in touch.order(events):
             if event.type == QUIT:
+                # the next run, or the console, starts on a lit screen
+                if power is not None:
+                    power.wake()
+                if recorder is not None:
+                    recorder.close()
+                if status_server is not None:
+                    status_server.stop()
+                interfaces.stop()
+                for printer in printers:
+                    printer.stop()
+                if touch_reader is not None:
+                    touch_reader.stop()
+                if not splash:
+                    save_frame(screen, config['frame_cache'])
                 return
             
             elif event.type == MOUSEBUTTONDOWN:
-                pygame.event.set_blocked(MOUSEBUTTONDOWN)
-                                
-                #if Button1.collidepoint(mouse_pos):
-                #    if is_paused == False:
-                #        post_info("job", {'command': 'pause', 'action': 'pause'})
-                #        pause_text = "Resume"
-                #        is_paused = True
-                #    else:
-                #        post_info('job', {'command': 'pause', 'action': 'resume'})
-                #        pause_text = "Pause"
-                #        is_paused = False
-                #        
-                #    pygame.draw.rect(background, WHITE, Button1)
-                #    pauseText = font.render(pause_text, True, BLACK)
-                #    background.blit(pauseText, (35,192))
-
-                #if Button2.collidepoint(mouse_pos):
-                #    pygame.draw.rect(background, WHITE, Button2)
-                #    background.blit(font.render("Cancel", True, BLACK), (152,192))
-                #    
-                #    cancel = confirm(background, "Are you sure you want to cancel the current job?")
-                #    if cancel == True:
-                #        post_info('job', {'command': 'cancel'})
-                                
-                #if Button3.collidepoint(mouse_pos):
-                #    pygame.draw.rect(background, WHITE, Button3)
-                #    background.blit(font.render("Reboot", True, BLACK), (275,192))
-                #    
-                #    check = confirm(screen, "Are you sure you want to reboot?")
-                #    if check == True:
-                #        backLight("0")
-                #        os.system("/sbin/reboot")
-                    
-                #if Button4.collidepoint(mouse_pos):
-                #    pygame.draw.rect(background, WHITE, Button4)
-                #    background.blit(font.render("Power Off", True, BLACK), (386,192))
-                #    check = confirm(screen, "Are you sure you want to power off?")
-                #    if check == True:
-                #        backLight("0")
-                #        os.system("/sbin/poweroff")
-                                    
-                if return_from_ss != True:
-                    runtime = 0
-                    
-                return_from_ss = False
-                
-                screen.blit(background, (0, 0))
-                pygame.display.flip()
-        
-                break
-            
+                if not touch.press(event.pos, hits):
+                    continue
+
+                last_touch = time.time()
+
+                # a touch on the cached frame asks for the real one
+                splash = False
+
+                # a touch on a dim or dark screen only wakes it, the frame
+                # below is drawn from scratch
+                if power is not None and power.level != AWAKE:
+                    touch.cancel()
+                    power.wake()
+                    renderer.invalidate()
+
+                elif touch.pressed is not None and touch.pressed.label:
+                    renderer.button(touch.pressed, small_font, WHITE)
+                    renderer.present()
+                    profiler.record('touch', time.time() - received)
+                    log.debug("touch feedback after %.1fms", (time.time() - received) * 1000)
+
+                elif panel == 'files' and browser.rect.collidepoint(event.pos):
+                    browser.press(event.pos, received)
+
+            elif event.type == MOUSEMOTION:
+                if panel == 'files':
+                    browser.move(event.pos, received)
+
             elif event.type == MOUSEBUTTONUP:
-                #if Button1.collidepoint(mouse_pos):
-                #    pygame.draw.rect(background, WHITE, Button1, 2)
-                #    background.blit(font.render(pause_text, True, BLACK), (35,192))
-                    
-                #if Button2.collidepoint(mouse_pos):
-                #    pygame.draw.rect(background, WHITE, Button2, 2)
-                #    background.blit(font.render("Cancel", True, BLACK), (152,192))
-                    
-                #if Button3.collidepoint(mouse_pos):
-                #    pygame.draw.rect(background, WHITE, Button3, 2)
-                #    background.blit(font.render("Reboot", True, BLACK), (275,192))
-                    
-                #if Button4.collidepoint(mouse_pos):
-                #    pygame.draw.rect(background, WHITE, Button4, 2)
-                #    background.blit(font.render("Power Off", True, BLACK), (386,192))
-                
-                pygame.event.set_allowed(MOUSEBUTTONDOWN)
-                
-            screen.blit(background, (0, 0))
-            pygame.display.flip()
+                if panel == 'files' and browser.drag is not None:
+                    entry = browser.release(event.pos, received)
+                    if entry is not None:
+                        if confirm(screen, "Print %s?" % entry['name'], touch):
+                            printers[selected].command({'command': 'select', 'print': True}, 'files/' + entry['origin'] + '/' + urllib.quote(entry['path'].encode('utf-8')))
+                            panel = None
+                        renderer.invalidate()
+                    continue
+
+                button = touch.release(event.pos)
+                if button is None:
+                    continue
+
+                if button.label:
+                    renderer.button(button, small_font, WHITE)
+                    renderer.present()
+
+                if button.name == 'printer':
+                    selected = button.value
+                    renderer.invalidate()
+
+                elif button.name == 'back':
+                    selected = None
+                    renderer.invalidate()
+
+                elif button.name == 'page':
+                    page = (page + 1) % ((len(printers) + overview_rows - 1) // overview_rows)
+                    renderer.invalidate()
+
+                elif button.name == 'pause':
+                    if button.label == "Resume":
+                        printers[selected].command({'command': 'pause', 'action': 'resume'})
+                    else:
+                        printers[selected].command({'command': 'pause', 'action': 'pause'})
+
+                elif button.name == 'cancel':
+                    if confirm(screen, "Are you sure you want to cancel the current job?", touch):
+                        printers[selected].command({'command': 'cancel'})
+                    renderer.invalidate()
+
+                elif button.name == 'files':
+                    printer = printers[selected]
+                    if printer.files is None:
+                        printer.files = FileList(printer.client, config['file_cache'])
+                        printer.files.on_change = scheduler.notify
+
+                    # the list on disk is shown while the server is asked
+                    # whether it is still current
+                    printer.files.refresh()
+                    browser.open(printer.files)
+                    panel = 'files'
+                    renderer.invalidate()
+
+                elif button.name == 'camera':
+                    printer = printers[selected]
+                    if printer.webcam is None:
+                        printer.webcam = WebcamFeed(printer.webcam_url, (320, 240), config['webcam_fps'], printer.client.timeout)
+                        printer.webcam.on_change = scheduler.notify
+                        printer.webcam.start()
+
+                    printer.webcam.active.set()
+                    panel = 'camera'
+                    renderer.invalidate()
+
+                elif button.name == 'close':
+                    if panel == 'camera':
+                        printers[selected].webcam.active.clear()
+                    panel = None
+                    renderer.invalidate()
+
+                elif button.name == 'reboot':
+                    if confirm(screen, "Are you sure you want to reboot?", touch):
+                        backLight("0")
+                        os.system("/sbin/reboot")
+                    renderer.invalidate()
+
+                elif button.name == 'poweroff':
+                    if confirm(screen, "Are you sure you want to power off?", touch):
+                        backLight("0")
+                        os.system("/sbin/poweroff")
+                    renderer.invalidate()
+
+        profiler.lap('events')
 
 	if screensaver_on is False:
-            progress_completion = None
-			
-            job = get_info('job');
-            if job is not None:
-                status = job['state']
-                file_name = job['job']['file']['name']
-                file_size = job['job']['file']['size']
-                progress_completion = job['progress']['completion']
-                if progress_completion is not None: progress_completion = int(round(progress_completion));
-                progress_printtimeleft = job['progress']['printTimeLeft']
-            else:
-                status = "Offline"
-                file_name = "_.gcode"
-                file_size = 0
-                progress_completion = "0"
-                progress_printtimeleft = "0"
-				
-            ver = get_info('version')
-            if ver is not None:
-                api_version = ver['api']
-                octo_version = ver['server']
-            else:
-                api_version = "0"
-                octo_version = "0"
-            
-            ext_f = "0"
-            bed_f = "0"
-			
-            stateinfo = get_info('connection')
-            if stateinfo is not None:
-                state = stateinfo['current']['state']
-            else:
-                state = "Offline"
-                progress_completion = 0
-                
-            if state != "Offline":
-                printer = get_info('printer')
-                if printer is not None:
-                    ext = int(printer['temperature']['tool0']['actual'])
-                    ext_target = int(printer['temperature']['tool0']['target'])
-                    bed = int(printer['temperature']['bed']['actual'])
-                    bed_target = int(printer['temperature']['bed']['target'])
+            # latest data published by the pollers, never blocks on the network
+            printing = False
+            for other in printers:
+                if other.poller.snapshot.state.startswith("Printing"):
+                    printing = True
+
+            if power is not None:
+                level = power.level
+                if power.update(time.time() - last_touch, printing) == DARK:
+                    # keep what was last shown for the next start up
+                    if level != DARK:
+                        save_frame(screen, config['frame_cache'])
+
+                    # nobody is watching the camera
+                    if panel == 'camera':
+                        printers[selected].webcam.active.clear()
+
+                    # the screen can't be seen, so don't draw it
+                    timeout = power.next_change(time.time() - last_touch)
+                    profiler.end('frame')
+                    continue
+
+            # the widgets that can be touched follow the screen being shown
+            if (selected, page, panel) != shown:
+                shown = (selected, page, panel)
+                hits.clear()
+                if panel is not None:
+                    hits.add(close)
+                elif selected is None:
+                    for widget in overview_widgets(len(printers), page, overview_rows):
+                        hits.add(widget)
                 else:
-                    ext = 0
-                    ext_target = 0
-                    bed = 0
-                    bed_target = 0
-            else:
-                ext = 0
-                ext_target = 0
-                bed = 0
-                bed_target = 0
+                    if len(printers) > 1:
+                        hits.add(back)
+                    if config['controls']:
+                        for button in controls:
+                            hits.add(button)
+                    if config['webcam']:
+                        hits.add(camera)
 
-            ext_f = CtoF(ext).ljust(3)
-            bed_f = CtoF(bed).ljust(3)
-				
-            if ext_target == 0 or bed_target == 0:
-                ext_target_f = "0".rjust(3)
-                bed_target_f = "0".rjust(3)
-            else:
-                ext_target_f = CtoF(ext_target).ljust(3)
-                bed_target_f = CtoF(bed_target).ljust(3)
-		           
-            # Fill background
-            background = createSurface(screen, BLACK)
-		
-            # get time for currently selected timezone
-            tzdata = datetime.now(timezone(default_timezone))
-                    
-            if ext_target_f == "32": ext_target_f = 0
-            if bed_target_f == "32": bed_target_f = 0;
-            if progress_printtimeleft is not None:
-                time = float(int(progress_printtimeleft))
-                day = time // (24 * 3600)
-                time = time % (24 * 3600)
-                hour = time // 3600
-                time %= 3600
-                minutes = time // 60
-                time %= 60
-            else:
-                time = 0
-                day = 0
-                hour = 0
-                minutes = 0
-                    
-            # render each string
-            status_text = ""
-            if progress_completion is not None and state != 'Offline':
-                status_text = "Status: " + state + " (" + `progress_completion` + "%)"
-            else:
-                status_text = "Status: " + state
+            if splash:
+                fresh = [printer for printer in printers if printer.poller.snapshot.updated != 0]
+                if not fresh and time.time() < splash_until:
+                    timeout = splash_until - time.time()
+                    profiler.end('frame')
+                    continue
+                splash = False
 
-            filename_text = ""
-            if file_name is not None and state != 'Offline':
-                filename_text = "Name:   " + file_name.replace("_", " ").replace(".gcode", "")
-            else:
-                filename_text = "Name: "
+            if panel == 'camera':
+                status = None
+                webcam = printers[selected].webcam
+
+                # fetching again after the screen was dark or saved
+                webcam.active.set()
+
+                renderer.button(close, small_font, WHITE)
+                renderer.text(90, 12, "%d frames, %d dropped" % (webcam.frames, webcam.dropped), WHITE)
+                profiler.lap('layout')
+
+                renderer.image(0, 45, webcam.surface, webcam.show())
+            elif panel == 'files':
+                status = None
+                if browser.moving():
+                    browser.step(time.time())
 
-            if file_size is not None and state != 'Offline':
-                size_text = "Size:   " + "{:,}".format(file_size) + " Bytes"
+                renderer.button(close, small_font, WHITE)
+                renderer.text(90, 12, "Files: %d" % len(browser.files.files), WHITE)
+                profiler.lap('layout')
+
+                renderer.image(browser.rect.left, browser.rect.top, browser.surface, browser.update())
+            elif selected is None:
+                status = None
+                lines = overview_lines(printers, page, overview_rows, stale_after)
+
+                profiler.lap('layout')
+
+                for x, y, text in lines:
+                    renderer.text(x, y, text, WHITE)
             else:
-                size_text = "Size:"
-            
-            ext_c = `ext`
-            ext_target_c = `ext_target`
-            bed_c = `bed`
-            bed_target_c = `bed_target`
-            
-            if state == 'Offline':
-                ext_f = "0"
-                bed_f = "0"
-            
-            bed_space = ""
-            if len(bed_f) == 2:
-                bed_space = " "
-            
-            printText(font, WHITE, status_text, background, 5,5)
-            printText(font, WHITE, filename_text, background, 5,30)
-            printText(font, WHITE, size_text, background, 5,55)
-            printText(font, WHITE, "ETA:    %02d:%02d:%02d" % (day, hour, minutes), background, 5, 80)
-            printText(font, WHITE, "wlan0:  " + getIPAddr('wlan0').ljust(15), background, 5, 130)
-            printText(font, WHITE, "        " + getHWAddr('wlan0').ljust(17), background, 5,155)
-            printText(font, WHITE, "eth0:   " + getIPAddr('eth0').ljust(15), background, 5, 180)
-            printText(font, WHITE, "        " + getHWAddr('eth0').ljust(17), background, 5, 205)
-
-            #if state != 'Offline':
-                #printText(font, WHITE, "Ver: " + api_version + "-" + octo_version, background, 330,5)
-                #printText(font, WHITE, "  [ extruder: " + ext_f.rjust(3) + ds + "F / " + ext_c.rjust(3) + ds + "C  " + bed_space + "  bed:    " + bed_space + "    " + bed_f.rjust(3).replace(' ', '') + ds + "F / " + bed_c.rjust(3).replace(' ', '') + ds + "C ]", background, 5, 110)
-                #printText(font, WHITE, "  [ target:   " + ext_target_f.rjust(3) + ds + "F / " + ext_target_c.rjust(3) + ds + "C  " + bed_space + "  target:     " + bed_target_f.rjust(3).replace(' ', '') + ds + "F /" + bed_target_c.rjust(3) + ds + "C ]", background, 5, 128)
-                #printText(font, WHITE, "%02d:%02d:%02d" % (day, hour, minutes), background, 205, 300)
-
-            #printText(font, WHITE, tzdata.strftime('%m-%d-%Y'), background, 5,300)
-            #printText(font, WHITE, tzdata.strftime('%H:%M:%S'), background, 405,300)
-            
-            #setProgress(background, progress_completion)
-    
-            # buttons
-            #pygame.draw.rect(background, WHITE, Button1, 2)
-            #background.blit(font.render(pause_text, True, WHITE), (35,192))
-            
-            #pygame.draw.rect(background, WHITE, Button2, 2)
-            #background.blit(font.render("Cancel", True, WHITE), (152,192))
-            
-            #pygame.draw.rect(background, WHITE, Button3, 2)
-            #background.blit(font.render("Reboot", True, WHITE), (275,192))
-            
-            #pygame.draw.rect(background, WHITE, Button4, 2)
-            #background.blit(font.render("Power Off", True, WHITE), (386,192))
-		
-            screen.blit(background, (0, 0))
-            pygame.display.flip()
+                printer = printers[selected]
+                status = printer.poller.estimated(time.time())
+                if printer.graph is None:
+                    printer.graph = TempGraph(310, 110, printer.history, config['temp_graph_span'])
+                if printer.preview is None and config['preview']:
+                    printer.preview = GcodePreview(printer.client, 80, config['preview_bed'], config['preview_cache'])
+                    printer.preview.on_change = scheduler.notify
 
-            runtime += 1
-			
-            if runtime == ssaver_time:
-                runtime = 0
+                state = status.state
+                name = None
+                if len(printers) > 1:
+                    name = printer.name
+                lines = status_lines(status, name, interfaces.interfaces, max_interfaces, time.time(), stale_after)
+
+                # the overlay takes the graph's place
+                if profiler.enabled and config['profile_overlay']:
+                    y = 480 - 17 * 7
+                    for line in profiler.overlay_lines(['fetch', 'touch', 'layout', 'render', 'present', 'frame']):
+                        lines.append((5, y, line))
+                        y += 17
+
+                profiler.lap('layout')
+
+                for x, y, text in lines:
+                    renderer.text(x, y, text, WHITE)
+
+                if not (profiler.enabled and config['profile_overlay']):
+                    renderer.image(5, 362, printer.graph.surface, printer.graph.update(time.time()))
+
+                # right of the interfaces, which leave that much room
+                if printer.preview is not None:
+                    renderer.image(235, 130, printer.preview.surface, printer.preview.show(status))
+
+                if config['controls']:
+                    if state == "Paused":
+                        controls[0].label = "Resume"
+                    else:
+                        controls[0].label = "Pause"
+
+                    for button in controls:
+                        renderer.button(button, small_font, WHITE)
+
+            profiler.lap('render')
+
+            renderer.present()
+            profiler.lap('present')
+
+            if profiler.enabled:
+                profiler.counters['pixels_per_second'] = renderer.pixels_per_second
+                profiler.counters['wakeups'] = scheduler.wakeups
+            profiler.end('frame')
+
+            if first_status:
+                log.info("first status %.0f ms after start", process_age() * 1000)
+                profiler.counters['first_status_ms'] = int(process_age() * 1000)
+                first_status = False
+
+            # sleep until the screensaver is due, or the next second while
+            # the age of stale data is counting up. new data and touches
+            # wake the loop sooner.
+            now = time.time()
+            if power is not None:
+                timeout = power.next_change(now - last_touch)
+            elif now - last_touch >= ssaver_after:
+                save_frame(screen, config['frame_cache'])
                 screensaver_on = True
+                timeout = 0
+
+                if panel == 'camera':
+                    printers[selected].webcam.active.clear()
+            else:
+                timeout = last_touch + ssaver_after - now
+
+            # wake for the next graph column even if nothing else changes
+            if status is not None:
+                if timeout is None:
+                    timeout = printer.graph.next_column(now)
+                else:
+                    timeout = min(timeout, printer.graph.next_column(now))
+
+            # the countdown ticks between fetches of the job
+            if status is not None and status.state.startswith("Printing"):
+                if timeout is None:
+                    timeout = 1.0
+                else:
+                    timeout = min(timeout, 1.0)
+
+            # a flicked list keeps scrolling
+            if panel == 'files' and browser.moving():
+                if timeout is None:
+                    timeout = 1.0 / 30
+                else:
+                    timeout = min(timeout, 1.0 / 30)
+
+            for other in printers:
+                updated = other.poller.snapshot.updated
+                if updated == 0 or now - updated > stale_after:
+                    if timeout is None:
+                        timeout = 1.0
+                    else:
+                        timeout = min(timeout, 1.0)
         else:
             # fire up the screensaver
             size = [320,480]
 			
             background = createSurface(screen, BLACK)
             screen.blit(background, (0, 0))
-            pygame.display.flip()
+            display.flip()
 
-            text_width = 13
-            groups = []
-            add_line = 1
-            pos = random.randint(1, size[0] / text_width + 1) * text_width - text_width / 2
+            matrixcode = "MP Mini Select V2 IIIP 3D Printer"
+            glyph_atlas.prepare(font, matrixcode + "0123456789:+-" + clock.code())
+            rain = MatrixRain(size, font, config['screensaver_density'], matrixcode)
 
             while True:
                 if screensaver_on is False:
                     break
-									
-		add_line -= 1
-		if add_line == 0:
-                    fast = random.randint(0,20)
-                    if fast == 0:
-                        speed = 3
-                    else:
-                        speed = random.randint(1,2)
-
-                    add_line = 2
-                    pos = random.randint(1, size[0] / text_width) * text_width - text_width / 2
-                    groups.append(Group([pos, -font.get_height()], speed))
-					
-                if random.randint(0, 50) == 50:
-                    matrixcode = "MP Mini Select V2 IIIP 3D Printer"
-                    code = list(matrixcode)
-                    random.shuffle(code, random.random)
-					
-                    pos = [random.randint(1, size[0] / text_width + 1) * text_width-text_width / 2, random.randint(1, size[1] / font.get_height() + 1) * font.get_height()]
-                    groups.append(CodePartical(pos, random.randint(0, len(code)-1), code))
-
-                for group in groups:
-                    group.modernize(font, size)
-                    if group.dead:
-                        groups.remove(group)
-						
-                rects = []
-                            
-                for group in groups:
-                    for rect in group.render(screen, font):
-                        rects.append(rect)
-
-                pygame.display.flip()
-                clock.tick(15)
+
+                frame_started = time.time()
+                profiler.begin()
+                rain.modernize()
+                profiler.lap('saver_update')
+
+                rects = rain.render(screen)
+
+                if profiler.enabled and config['profile_overlay']:
+                    y = 480 - 17 * 5
+                    for line in profiler.overlay_lines(['saver_update', 'saver_render', 'saver_present', 'saver_frame']):
+                        rects.append(printText(font, WHITE, line, screen, 5, y))
+                        y += 17
+
+                profiler.lap('saver_render')
+
+                display.flip()
+                profiler.lap('saver_present')
+                profiler.end('saver_frame')
 				
                 for rect in rects:
                     screen.fill([0,0,0], rect)
 
-                for event in pygame.event.get():
-                    if event.type is MOUSEBUTTONUP:
+                # a touch ends the wait for the next frame straight away
+                for event in scheduler.wait(saver_interval - (time.time() - frame_started)):
+                    if event.type == MOUSEBUTTONUP:
                         screensaver_on = False
-                        return_from_ss = True
+                        last_touch = time.time()
+                        timeout = 0
+                        renderer.invalidate()
+                        log.debug("text cache %s, glyph atlas %s", text_cache.stats(), glyph_atlas.stats())
                         break
                     elif event.type == QUIT:
+                        if recorder is not None:
+                            recorder.close()
+                        if status_server is not None:
+                            status_server.stop()
+                        interfaces.stop()
+                        for printer in printers:
+                            printer.stop()
+                        if touch_reader is not None:
+                            touch_reader.stop()
                         return
 
-if __name__ == '__main__': main()
+if __name__ == '__main__':
+    logging.basicConfig(level=getattr(logging, config['log_level']))
+    main()
 